@@ -1,16 +1,32 @@
+import json
 import os
-import re
-import sqlite3
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
-from rerank import fetch_candidates_faiss as fetch_candidates
-from rerank import rerank as rerank_candidates
+import chunk_store
+import metrics
+import sentences
+from batching import MicroBatcher
+from inference import embedding_key
+from query_cache import QueryCache
+from rerank import fetch_candidates_faiss_batch as fetch_candidates_batch
+from rerank import fetch_candidates_hybrid_batch
+from rerank import rerank_batch as rerank_candidates_batch
+from rerank import FUSIONS, RERANK_DEPTH
+from rerank import engine, load_models, models_loaded
 
-DB_PATH = "data/chunks.db"
 DATA_DIR = "data"
 
+# Concurrent /ask requests are coalesced into one encode/search/rerank pass.
+# Set ASK_BATCH_MAX_SIZE=1 to process every request on its own.
+ASK_BATCH_MAX_SIZE = int(os.environ.get("ASK_BATCH_MAX_SIZE", 16))
+ASK_BATCH_MAX_WAIT_MS = float(os.environ.get("ASK_BATCH_MAX_WAIT_MS", 5))
+
+# Sent through every requested mode by /warmup
+WARMUP_QUERY = "How to perform lockout/tagout?"
+
 # Ensure data directory exists so the server starts even on fresh clones
 os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -18,87 +34,399 @@ app = Flask(__name__)
 
 
 def get_doc_meta(chunk_ids: List[int]) -> Dict[int, Dict[str, Any]]:
-    if not chunk_ids:
-        return {}
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    placeholders = ",".join(["?"] * len(chunk_ids))
-    cur.execute(
-        f"""
-        SELECT c.chunk_id, d.title, d.url, d.doc_id
-        FROM chunks c
-        JOIN docs d ON c.doc_id = d.doc_id
-        WHERE c.chunk_id IN ({placeholders})
-        """,
-        tuple(chunk_ids),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return {int(cid): {"title": title, "url": url} for cid, title, url, _ in rows}
+    with metrics.span("doc_meta"):
+        rows = chunk_store.fetch_chunks(chunk_ids)
+    return {cid: {"title": r["title"], "url": r["url"], "page": r["page"]} for cid, r in rows.items()}
 
 
 def split_sentences(text: str) -> List[str]:
-    parts = re.split(r"(?<=[.!?])\s+", text.strip())
-    return [p.strip() for p in parts if p.strip()]
+    return [text[s:e] for s, e in sentences.split_spans(text)]
 
 
 def best_extractive_snippet(query: str, text: str, max_sents: int = 2) -> str:
-    q_terms = set(re.findall(r"[a-z0-9]+", query.lower()))
-    sents = split_sentences(text)
-    scored = []
-    for s in sents:
-        s_terms = set(re.findall(r"[a-z0-9]+", s.lower()))
-        overlap = len(q_terms & s_terms)
-        scored.append((overlap, s))
-    scored.sort(key=lambda x: (x[0], len(x[1])), reverse=True)
-    top = [s for _, s in scored[:max_sents]]
-    return " " .join(top)[:500]
-
-
-def retrieve(query: str, k: int, mode: str) -> List[Dict[str, Any]]:
-    candidates = fetch_candidates(query, top_k=max(k, 50))
-    # candidates: list of (chunk_id, base_score, text)
+    # For text without a stored sentence index; indexes it on the spot
+    index = sentences.build(text)
+    return sentences.select(text, index, sentences.overlap_scores(query, index), max_sents)
+
+
+def context_snippet(query: str, context: Dict[str, Any]) -> str:
+    """
+    Best sentences of the full chunk behind a context (whose "text" is a
+    300-char preview), scored with the sentence index stored at ingest.
+    """
+    chunk_id = context["chunk_id"]
+    found = chunk_store.fetch_sentence_index([chunk_id]).get(chunk_id)
+    if found is None:
+        return best_extractive_snippet(query, context["text"])
+    text, index = found
+    scores = None
+    if sentences.SNIPPET_MODE == "embedding":
+        # The query vector is normally still in the engine's memo from retrieval
+        scores = sentences.embedding_scores(engine.encode([query])[0], chunk_id, index, embedding_key())
+    if scores is None:
+        scores = sentences.overlap_scores(query, index)
+    return sentences.select(text, index, scores)
+
+
+class AskRequest(NamedTuple):
+    q: str
+    k: int
+    mode: str  # "baseline" | "rerank" | "hybrid"
+    nprobe: Optional[int] = None  # IVF indexes only
+    ef_search: Optional[int] = None  # HNSW indexes only
+    depth: Optional[int] = None  # candidates that reach the cross-encoder (default RERANK_DEPTH, else all)
+    fusion: Optional[str] = None  # hybrid only: "rrf" | "weighted" (default HYBRID_FUSION)
+    debug_timings: bool = False  # add the per-stage breakdown (ms) to the response
+
+
+MODES = ("baseline", "rerank", "hybrid")
+
+
+def _positive_int(name: str, value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be a positive integer")
+    try:
+        n = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a positive integer") from None
+    if n < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return n
+
+
+def parse_ask_request(data: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> AskRequest:
+    """
+    Validated request; raises ValueError (answered with 400) for a missing q
+    or bad parameters, so malformed input never reaches the cache or the
+    micro-batcher.
+    """
+    defaults = defaults or {}
+    q = data.get("q") if isinstance(data, dict) else None
+    if not isinstance(q, str) or not q.strip():
+        raise ValueError("missing q")
+    mode = data.get("mode", defaults.get("mode", "rerank"))
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    fusion = data.get("fusion", defaults.get("fusion"))
+    if fusion is not None and fusion not in FUSIONS:
+        raise ValueError(f"fusion must be one of {', '.join(FUSIONS)}")
+    return AskRequest(
+        q=q.strip(),
+        k=_positive_int("k", data.get("k", defaults.get("k", 5))),
+        mode=mode,
+        nprobe=_positive_int("nprobe", data.get("nprobe", defaults.get("nprobe"))),
+        ef_search=_positive_int("ef_search", data.get("ef_search", defaults.get("ef_search"))),
+        depth=_positive_int("depth", data.get("depth", defaults.get("depth"))),
+        fusion=fusion,
+        debug_timings=bool(data.get("debug_timings", defaults.get("debug_timings", False))),
+    )
+
+
+def parse_ask_batch(data: Dict[str, Any]) -> Tuple[List[AskRequest], Optional[str]]:
+    """(requests, None), or ([], error message) for a malformed /ask_batch body."""
+    queries = data.get("queries") or []
+    if not isinstance(queries, list) or not queries:
+        return [], "missing queries"
+    requests = []
+    for item in queries:
+        if isinstance(item, str):
+            item = {"q": item}
+        elif not isinstance(item, dict):
+            return [], "missing q"
+        try:
+            requests.append(parse_ask_request(item, defaults=data))
+        except ValueError as e:
+            return [], str(e)
+    return requests, None
+
+
+def parse_warmup_modes(data: Dict[str, Any]) -> Tuple[str, ...]:
+    """Modes to warm from a /warmup body; raises ValueError (answered with 400) for bad input."""
+    modes = data.get("modes") if isinstance(data, dict) else None
+    if modes is None:
+        return ("baseline", "rerank")
+    if not isinstance(modes, list) or not modes or any(m not in MODES for m in modes):
+        raise ValueError(f"modes must be a non-empty list of {', '.join(MODES)}")
+    return tuple(modes)
+
+
+def _rerank_depth(req: AskRequest) -> Optional[int]:
+    # None cross-encodes every candidate; an explicit depth never prunes below k
+    depth = req.depth or RERANK_DEPTH
+    return max(depth, req.k) if depth else None
+
+
+def retrieve(query: str, k: int, mode: str, nprobe: Optional[int] = None,
+             ef_search: Optional[int] = None, depth: Optional[int] = None,
+             fusion: Optional[str] = None) -> List[Dict[str, Any]]:
+    return retrieve_batch([AskRequest(query, k, mode, nprobe, ef_search, depth, fusion)])[0]
+
+
+def retrieve_batch(requests: List[AskRequest]) -> List[List[Dict[str, Any]]]:
+    return [contexts for contexts, _ in retrieve_batch_with_info(requests)]
+
+
+def retrieve_batch_with_info(requests: List[AskRequest]) -> List[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    # One FAISS search per distinct (nprobe, ef_search) and one rerank pass for the whole batch
+    if not requests:
+        return []
+    depths = [max(r.k, 50) for r in requests]
+    infos: List[Dict[str, Any]] = [{} for _ in requests]
+    all_candidates = [None] * len(requests)
+    groups: Dict[Any, List[int]] = {}
+    for i, r in enumerate(requests):
+        key = (r.nprobe, r.ef_search, r.fusion) if r.mode == "hybrid" else (r.nprobe, r.ef_search)
+        groups.setdefault(key, []).append(i)
+    for key, rows in groups.items():
+        nprobe, ef_search = key[0], key[1]
+        queries = [requests[i].q for i in rows]
+        top_k = max(depths[i] for i in rows)
+        if len(key) == 3:
+            # hybrid: FAISS and full-index BM25 legs, fused; candidates are dicts
+            found, timings = fetch_candidates_hybrid_batch(
+                queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search, fusion=key[2])
+            for i in rows:
+                infos[i]["timings_ms"] = timings
+        else:
+            found = fetch_candidates_batch(queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
+        # candidates: list of (chunk_id, base_score, text), trimmed back to each request's own depth
+        for i, cands in zip(rows, found):
+            all_candidates[i] = cands[:depths[i]]
+
+    rerank_rows = [i for i, r in enumerate(requests) if r.mode == "rerank"]
+    reranked = rerank_candidates_batch(
+        [requests[i].q for i in rerank_rows],
+        [all_candidates[i] for i in rerank_rows],
+        # Never prune below k
+        depths=[_rerank_depth(requests[i]) for i in rerank_rows],
+    )
+    reranked_by_row = dict(zip(rerank_rows, reranked))
+
+    tops = []
+    for i, r in enumerate(requests):
+        if r.mode == "rerank":
+            tops.append(reranked_by_row[i][:r.k])
+        elif r.mode == "hybrid":
+            # already ordered by fused score
+            tops.append(all_candidates[i][:r.k])
+        else:
+            tops.append(baseline_top(all_candidates[i], r.k))
+
+    meta = get_doc_meta(list({r["chunk_id"] for top in tops for r in top}))
+    return [
+        ([to_context(r, req.mode, meta) for r in top], info_extra)
+        for req, top, info_extra in zip(requests, tops, infos)
+    ]
+
+
+def baseline_top(candidates, k: int) -> List[Dict[str, Any]]:
+    # baseline: sort (chunk_id, base_score, text) candidates by base_score
+    return sorted(
+        (
+            {"chunk_id": int(cid), "base_score": float(score), "text": txt}
+            for cid, score, txt in candidates
+        ),
+        key=lambda r: r["base_score"],
+        reverse=True,
+    )[:k]
+
+
+def to_context(r: Dict[str, Any], mode: str, meta: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    info = meta.get(r["chunk_id"], {"title": None, "url": None, "page": None})
     if mode == "rerank":
-        reranked = rerank_candidates(query, candidates)
-        top = reranked[:k]
-        chunk_ids = [r["chunk_id"] for r in top]
-        meta = get_doc_meta(chunk_ids)
-        contexts = []
-        for r in top:
-            info = meta.get(r["chunk_id"], {"title": None, "url": None})
-            contexts.append({
-                "chunk_id": r["chunk_id"],
-                "score": r.get("base_score"),
-                "rerank_score": r.get("rerank_score"),
-                "bm25_score": r.get("bm25_score"),
-                "title": info["title"],
-                "url": info["url"],
-                "text": r["text"],
-            })
-        return contexts
+        return {
+            "chunk_id": r["chunk_id"],
+            "score": r.get("base_score"),
+            "rerank_score": r.get("rerank_score"),
+            "bm25_score": r.get("bm25_score"),
+            "title": info["title"],
+            "url": info["url"],
+            "page": info["page"],
+            "text": r["text"],
+        }
+    elif mode == "hybrid":
+        return {
+            "chunk_id": r["chunk_id"],
+            "score": r["vector_score"],  # None when only BM25 found it
+            "hybrid_score": r["hybrid_score"],
+            "bm25_score": r["bm25_score"],
+            "title": info["title"],
+            "url": info["url"],
+            "page": info["page"],
+            "text": r["text"][:300] + ("..." if len(r["text"]) > 300 else ""),
+        }
+    return {
+        "chunk_id": r["chunk_id"],
+        "score": r["base_score"],
+        "title": info["title"],
+        "url": info["url"],
+        "page": info["page"],
+        "text": r["text"][:300] + ("..." if len(r["text"]) > 300 else ""),
+    }
+
+
+# Served generation, so a rebuilt index invalidates cached answers
+query_cache = QueryCache(generation_fn=lambda: engine.snapshot().generation)
+
+
+def cache_params(req: AskRequest) -> tuple:
+    return (req.k, req.mode, req.nprobe, req.ef_search, req.depth, req.fusion)
+
+
+def answer(req: AskRequest) -> Dict[str, Any]:
+    if batcher is not None:
+        return batcher.submit(req)
+    return answer_batch([req])[0]
+
+
+def answer_batch(requests: List[AskRequest]) -> List[Dict[str, Any]]:
+    # Serve what the query cache can; retrieve the rest in one batch
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+    embeddings = [None] * len(requests)
+    missed = []
+    with metrics.collect() as lookup_timings:
+        for i, req in enumerate(requests):
+            with metrics.span("cache_lookup"):
+                # A semantic lookup follows an exact miss; only that one counts the miss
+                hit, kind = query_cache.get(req.q, cache_params(req), count_miss=not query_cache.semantic)
+            if hit is not None:
+                responses[i] = dict(hit, cache=kind)
+            else:
+                missed.append(i)
+        if missed and query_cache.semantic:
+            # One encode for all exact misses; the engine reuses these embeddings for the search
+            q_emb = engine.encode([requests[i].q for i in missed])
+            still_missed = []
+            for i, emb in zip(missed, q_emb):
+                embeddings[i] = emb
+                with metrics.span("cache_lookup"):
+                    hit, kind = query_cache.get(requests[i].q, cache_params(requests[i]), embedding=emb)
+                if hit is not None:
+                    responses[i] = dict(hit, cache=kind)
+                else:
+                    still_missed.append(i)
+            missed = still_missed
+
+    with metrics.collect() as batch_timings:
+        results = retrieve_batch_with_info([requests[i] for i in missed])
+    for i, (contexts, info) in zip(missed, results):
+        req = requests[i]
+        with metrics.collect() as answer_timings:
+            response = build_response(req.q, contexts, req.mode, info)
+        query_cache.put(req.q, cache_params(req), response, embedding=embeddings[i])
+        responses[i] = dict(response, cache=None)
+        if req.debug_timings:
+            # Batch stages are shared by every question in the batch
+            responses[i]["debug_timings"] = dict(
+                metrics.merge_timings(lookup_timings, batch_timings, answer_timings), batch_size=len(missed))
+
+    for req, response in zip(requests, responses):
+        metrics.REQUESTS.inc(mode=req.mode)
+        if response["abstain_reason"]:
+            metrics.ABSTAINS.inc(mode=req.mode)
+        if response["cache"]:
+            metrics.CACHE_HITS.inc(mode=req.mode, level=response["cache"])
+            if req.debug_timings:
+                response["debug_timings"] = dict(lookup_timings, batch_size=0)
+    return responses
+
+
+def observe_latency(endpoint: str, requests: List[AskRequest], seconds: float):
+    for req in requests:
+        metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint, mode=req.mode)
+
+
+def answer_stream(req: AskRequest) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    The /ask pipeline for one question as a sequence of (event, data):
+
+      ("contexts", {"stage": "baseline", "contexts": [...]})  right after the FAISS search
+      ("contexts", {"stage": "rerank", "contexts": [...]})    mode=rerank, once reranking is done
+      ("answer", <the /ask response>)                         always last
+
+    mode=hybrid sends one "contexts" event with stage "hybrid". A cached
+    response is sent as the "answer" event alone. Bypasses the micro-batcher.
+    """
+    timings: Dict[str, float] = {}
+    embedding = None
+    with metrics.collect() as t:
+        with metrics.span("cache_lookup"):
+            hit, kind = query_cache.get(req.q, cache_params(req), count_miss=not query_cache.semantic)
+        if hit is None and query_cache.semantic:
+            embedding = engine.encode([req.q])[0]
+            with metrics.span("cache_lookup"):
+                hit, kind = query_cache.get(req.q, cache_params(req), embedding=embedding)
+    timings = metrics.merge_timings(timings, t)
+    if hit is not None:
+        metrics.REQUESTS.inc(mode=req.mode)
+        metrics.CACHE_HITS.inc(mode=req.mode, level=kind)
+        if hit["abstain_reason"]:
+            metrics.ABSTAINS.inc(mode=req.mode)
+        response = dict(hit, cache=kind)
+        if req.debug_timings:
+            response["debug_timings"] = dict(timings, batch_size=0)
+        yield "answer", response
+        return
+
+    info = None
+    # Each stage collects its own timings: the consumer may resume this generator on another thread
+    if req.mode == "hybrid":
+        with metrics.collect() as t:
+            contexts, info = retrieve_batch_with_info([req])[0]
+        timings = metrics.merge_timings(timings, t)
+        yield "contexts", {"stage": "hybrid", "contexts": contexts}
     else:
-        # baseline: sort by base_score
-        candidates_sorted = sorted(
-            (
-                {"chunk_id": int(cid), "base_score": float(score), "text": txt}
-                for cid, score, txt in candidates
-            ),
-            key=lambda r: r["base_score"],
-            reverse=True,
-        )[:k]
-        chunk_ids = [r["chunk_id"] for r in candidates_sorted]
-        meta = get_doc_meta(chunk_ids)
-        contexts = []
-        for r in candidates_sorted:
-            info = meta.get(r["chunk_id"], {"title": None, "url": None})
-            contexts.append({
-                "chunk_id": r["chunk_id"],
-                "score": r["base_score"],
-                "title": info["title"],
-                "url": info["url"],
-                "text": r["text"][:300] + ("..." if len(r["text"]) > 300 else ""),
-            })
-        return contexts
+        with metrics.collect() as t:
+            candidates = fetch_candidates_batch([req.q], top_k=max(req.k, 50), nprobe=req.nprobe,
+                                                ef_search=req.ef_search)[0]
+            top = baseline_top(candidates, req.k)
+            meta = get_doc_meta([r["chunk_id"] for r in top])
+            contexts = [to_context(r, "baseline", meta) for r in top]
+        timings = metrics.merge_timings(timings, t)
+        yield "contexts", {"stage": "baseline", "contexts": contexts}
+
+        if req.mode == "rerank":
+            with metrics.collect() as t:
+                top = rerank_candidates_batch([req.q], [candidates],
+                                              depths=[_rerank_depth(req)])[0][:req.k]
+                meta.update(get_doc_meta([r["chunk_id"] for r in top if r["chunk_id"] not in meta]))
+                contexts = [to_context(r, "rerank", meta) for r in top]
+            timings = metrics.merge_timings(timings, t)
+            yield "contexts", {"stage": "rerank", "contexts": contexts}
+
+    with metrics.collect() as t:
+        response = build_response(req.q, contexts, req.mode, info)
+    query_cache.put(req.q, cache_params(req), response, embedding=embedding)
+    metrics.REQUESTS.inc(mode=req.mode)
+    if response["abstain_reason"]:
+        metrics.ABSTAINS.inc(mode=req.mode)
+    response = dict(response, cache=None)
+    if req.debug_timings:
+        response["debug_timings"] = dict(metrics.merge_timings(timings, t), batch_size=1)
+    yield "answer", response
+
+
+def format_event(event: str, data: Dict[str, Any], sse: bool) -> str:
+    # NDJSON: one {"event": ..., **data} object per line; SSE: "event:" and "data:" fields
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps(dict(data, event=event)) + "\n"
+
+
+def wants_sse(accept: Optional[str], fmt: Optional[str]) -> bool:
+    return fmt == "sse" or (fmt is None and "text/event-stream" in (accept or ""))
+
+
+STREAM_CONTENT_TYPES = {True: "text/event-stream", False: "application/x-ndjson"}
+
+
+batcher = (
+    MicroBatcher(answer_batch, max_batch_size=ASK_BATCH_MAX_SIZE, max_wait_ms=ASK_BATCH_MAX_WAIT_MS)
+    if ASK_BATCH_MAX_SIZE > 1
+    else None
+)
 
 
 def build_answer(query: str, contexts: List[Dict[str, Any]], mode: str):
@@ -109,39 +437,140 @@ def build_answer(query: str, contexts: List[Dict[str, Any]], mode: str):
         top_score = contexts[0].get("rerank_score", 0.0) or 0.0
         if top_score < 0.45:
             return None, f"low_confidence_rerank:{top_score:.3f}"
+    elif mode == "hybrid":
+        # Same bar as baseline, on the best vector score among the fused contexts
+        top_score = max((c["score"] for c in contexts if c.get("score") is not None), default=0.0)
+        if top_score < 0.30:
+            return None, f"low_confidence_hybrid:{top_score:.3f}"
     else:
         top_score = contexts[0].get("score", 0.0) or 0.0
         if top_score < 0.30:
             return None, f"low_confidence_baseline:{top_score:.3f}"
 
     top = contexts[0]
-    snippet = best_extractive_snippet(query, top["text"]) or top["text"][:300]
+    with metrics.span("snippet"):
+        snippet = context_snippet(query, top) or top["text"][:300]
     citation = {
         "title": top.get("title"),
         "url": top.get("url"),
+        "page": top.get("page"),
         "chunk_id": top.get("chunk_id"),
     }
     answer = f"{snippet}"
     return {"text": answer, "citation": citation}, None
 
 
+_warm = False
+
+
+def health() -> Dict[str, Any]:
+    # Liveness: never loads anything
+    return {"status": "ok", "warm": _warm, "models": models_loaded(), "index_generation": engine.generation}
+
+
+def warmup(modes=("baseline", "rerank")) -> Dict[str, Any]:
+    """Load models and the index, then run one query per mode (bypassing the query cache)."""
+    global _warm
+    timings = {}
+    t0 = time.perf_counter()
+    load_models(modes)
+    timings["models_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    t0 = time.perf_counter()
+    engine.snapshot()
+    timings["index_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    t0 = time.perf_counter()
+    retrieve_batch([AskRequest(WARMUP_QUERY, 1, mode) for mode in modes])
+    timings["query_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _warm = True
+    return dict(health(), timings_ms=timings)
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify(health())
+
+
+@app.post("/warmup")
+def warmup_endpoint():
+    # Body (optional): {"modes": ["baseline", "rerank", "hybrid"]}
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        modes = parse_warmup_modes(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(warmup(modes))
+
+
 @app.post("/ask")
 def ask():
     data = request.get_json(force=True) or {}
-    q = data.get("q", "").strip()
-    k = int(data.get("k", 5))
-    mode = data.get("mode", "rerank")  # "baseline" | "rerank"
-    if not q:
-        return jsonify({"error": "missing q"}), 400
+    try:
+        req = parse_ask_request(data)  # mode: "baseline" | "rerank" | "hybrid"
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    t0 = time.perf_counter()
+    response = answer(req)
+    observe_latency("ask", [req], time.perf_counter() - t0)
+    return jsonify(response)
+
+
+@app.post("/ask_stream")
+def ask_stream():
+    # Same body as /ask; NDJSON by default, SSE with "Accept: text/event-stream" or ?format=sse
+    data = request.get_json(force=True) or {}
+    try:
+        req = parse_ask_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sse = wants_sse(request.headers.get("Accept"), request.args.get("format"))
+
+    def generate():
+        t0 = time.perf_counter()
+        for event, payload in answer_stream(req):
+            yield format_event(event, payload, sse)
+        observe_latency("ask_stream", [req], time.perf_counter() - t0)
+
+    return Response(stream_with_context(generate()), content_type=STREAM_CONTENT_TYPES[sse],
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/ask_batch")
+def ask_batch():
+    # Body: {"queries": ["...", {"q": "...", "k": 3, "mode": "baseline"}, ...], "k": 5, "mode": "rerank"}
+    data = request.get_json(force=True) or {}
+    requests, error = parse_ask_batch(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    t0 = time.perf_counter()
+    results = answer_batch(requests)
+    observe_latency("ask_batch", requests, time.perf_counter() - t0)
+    return jsonify({"results": results})
+
 
-    contexts = retrieve(q, k=k, mode=mode)
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/cache_stats")
+def cache_stats():
+    return jsonify(query_cache.snapshot_stats())
+
+
+def build_response(q: str, contexts: List[Dict[str, Any]], mode: str,
+                   info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     answer, abstain_reason = build_answer(q, contexts, mode)
-    return jsonify({
+    response = {
         "answer": answer,  # or null
         "contexts": contexts,
         "reranker_used": mode == "rerank",
         "abstain_reason": abstain_reason,
-    })
+    }
+    if info and "timings_ms" in info:
+        response["timings_ms"] = info["timings_ms"]  # hybrid: dense_ms / lexical_ms / fusion_ms
+    return response
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+# asgi_app.py
+"""
+ASGI version of the /ask service. Same request/response shapes as api.py.
+
+The event loop only parses requests and writes responses; encoding, FAISS,
+SQLite and the cross-encoder run in a bounded thread pool (torch, FAISS and
+sqlite3 release the GIL, and a thread pool shares one copy of the models).
+Concurrent /ask calls still meet in api.py's micro-batcher.
+
+  uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+
+ASGI_POOL_SIZE     inference threads (default: CPU count)
+ASGI_QUEUE_LIMIT   requests in flight or waiting before answering 503 (default: 4 x pool size)
+ASK_TIMEOUT_S      per-request deadline before answering 504 (default 10)
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import api
+import metrics
+
+ASGI_POOL_SIZE = int(os.environ.get("ASGI_POOL_SIZE", os.cpu_count() or 4))
+ASGI_QUEUE_LIMIT = int(os.environ.get("ASGI_QUEUE_LIMIT", 4 * ASGI_POOL_SIZE))
+ASK_TIMEOUT_S = float(os.environ.get("ASK_TIMEOUT_S", 10))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_POOL_SIZE, thread_name_prefix="ask")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Admission:
+    """
+    Counts work handed to the pool. A slot is only released when the work
+    actually finishes, so requests that timed out still count against the
+    limit while their thread is busy.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args) -> asyncio.Future:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                raise Overloaded()
+            self.in_flight += 1
+        fut = executor.submit(fn, *args)
+        fut.add_done_callback(self._release)
+        return asyncio.wrap_future(fut)
+
+    def _release(self, _):
+        with self._lock:
+            self.in_flight -= 1
+
+
+admission = Admission(ASGI_QUEUE_LIMIT)
+
+
+async def _read_json(request) -> dict:
+    # Mirrors Flask's get_json(force=True) or {}
+    try:
+        data = json.loads(await request.body() or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _run(fn, *args) -> JSONResponse:
+    try:
+        result = await asyncio.wait_for(admission.submit(fn, *args), timeout=ASK_TIMEOUT_S)
+    except Overloaded:
+        return JSONResponse({"error": "overloaded"}, status_code=503, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": f"timed out after {ASK_TIMEOUT_S:g}s"}, status_code=504)
+    return JSONResponse(result)
+
+
+async def ask(request):
+    try:
+        req = api.parse_ask_request(await _read_json(request))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    t0 = time.perf_counter()
+    response = await _run(api.answer, req)
+    if response.status_code == 200:
+        api.observe_latency("ask", [req], time.perf_counter() - t0)
+    return response
+
+
+async def ask_stream(request):
+    """
+    Streams api.answer_stream() events. Each step runs in the pool; the first
+    one is awaited before responding, so overload and timeout still map to
+    503/504. Later failures end the stream with an "error" event.
+    """
+    try:
+        req = api.parse_ask_request(await _read_json(request))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    sse = api.wants_sse(request.headers.get("accept"), request.query_params.get("format"))
+    t0 = time.perf_counter()
+    deadline = t0 + ASK_TIMEOUT_S
+    events = api.answer_stream(req)
+
+    async def step():
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(admission.submit(next, events, None), timeout=remaining)
+
+    try:
+        first = await step()
+    except Overloaded:
+        return JSONResponse({"error": "overloaded"}, status_code=503, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": f"timed out after {ASK_TIMEOUT_S:g}s"}, status_code=504)
+
+    async def body():
+        item = first
+        while item is not None:
+            yield api.format_event(*item, sse)
+            try:
+                item = await step()
+            except Overloaded:
+                yield api.format_event("error", {"error": "overloaded"}, sse)
+                return
+            except asyncio.TimeoutError:
+                yield api.format_event("error", {"error": f"timed out after {ASK_TIMEOUT_S:g}s"}, sse)
+                return
+        api.observe_latency("ask_stream", [req], time.perf_counter() - t0)
+
+    return StreamingResponse(body(), media_type=api.STREAM_CONTENT_TYPES[sse],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def ask_batch(request):
+    requests, error = api.parse_ask_batch(await _read_json(request))
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    t0 = time.perf_counter()
+    response = await _run(lambda reqs: {"results": api.answer_batch(reqs)}, requests)
+    if response.status_code == 200:
+        api.observe_latency("ask_batch", requests, time.perf_counter() - t0)
+    return response
+
+
+async def healthz(request):
+    return JSONResponse(api.health())
+
+
+async def warmup(request):
+    try:
+        modes = api.parse_warmup_modes(await _read_json(request))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    # Not admission-controlled: orchestration calls this before sending traffic
+    result = await asyncio.wrap_future(executor.submit(api.warmup, modes))
+    return JSONResponse(result)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def cache_stats(request):
+    return JSONResponse(dict(api.query_cache.snapshot_stats(), in_flight=admission.in_flight,
+                             queue_limit=admission.limit))
+
+
+app = Starlette(routes=[
+    Route("/ask", ask, methods=["POST"]),
+    Route("/ask_stream", ask_stream, methods=["POST"]),
+    Route("/ask_batch", ask_batch, methods=["POST"]),
+    Route("/cache_stats", cache_stats, methods=["GET"]),
+    Route("/healthz", healthz, methods=["GET"]),
+    Route("/warmup", warmup, methods=["POST"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+])
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
@@ -0,0 +1,75 @@
+# batching.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submit() calls into batches for `handler`.
+
+    A background thread waits for the first item, then keeps collecting
+    until either `max_batch_size` items are queued or `max_wait_ms` has
+    passed, and calls handler(items) -> results (same length and order).
+    Each caller blocks until its own result is ready. If the handler raises,
+    the batch is retried item by item, so an exception reaches only the
+    caller whose item caused it.
+
+    The thread is started on first use and restarted in a forked child
+    (threads don't survive fork), so an instance created in a preloading
+    parent process works in every worker.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> queue.Queue:
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="micro-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, item: Any) -> Any:
+        fut = Future()
+        self._ensure_started().put((item, fut))
+        return fut.result()
+
+    def _run(self, q: queue.Queue):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._handle(batch)
+
+    def _handle(self, batch):
+        try:
+            results = self.handler([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Retry one by one so a bad item only fails its own caller
+            for entry in batch:
+                self._handle([entry])
+            return
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)
@@ -0,0 +1,6 @@
+"""
+Retrieval benchmarks on synthetic corpora; runs offline with INFERENCE_BACKEND=hash.
+
+  python -m bench.run --chunks 10000 --out bench_results.json
+  python -m bench.run --compare old.json new.json
+"""
@@ -0,0 +1,97 @@
+# bench/corpus.py
+import json
+import random
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import ingest
+from utils import sha1_hash
+
+SYLLABLES = ["ka", "lo", "mi", "ter", "sun", "vad", "pre", "om", "zu", "rin", "tal", "fe", "gor", "ix", "bel", "nu"]
+VOCAB_SIZE = 20000
+WORDS_PER_SENTENCE = 15
+SENTENCES_PER_CHUNK = 10
+CHUNKS_PER_DOC = 100
+CHUNKS_PER_PAGE = 4
+GEN_BATCH = 10000
+
+
+def make_vocab(size: int = VOCAB_SIZE, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    vocab = set()
+    while len(vocab) < size:
+        vocab.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(vocab)
+
+
+def iter_chunk_texts(n_chunks: int, vocab: List[str], seed: int = 0):
+    """Zipf-distributed word salad in sentences, so BM25 and embeddings see realistic term skew."""
+    rng = np.random.default_rng(seed)
+    words = np.array(vocab)
+    p = 1.0 / np.arange(1, len(vocab) + 1)
+    p /= p.sum()
+    per_chunk = WORDS_PER_SENTENCE * SENTENCES_PER_CHUNK
+    for start in range(0, n_chunks, GEN_BATCH):
+        n = min(GEN_BATCH, n_chunks - start)
+        picks = words[rng.choice(len(vocab), size=(n, per_chunk), p=p)]
+        for row in picks:
+            yield " ".join(
+                " ".join(row[i:i + WORDS_PER_SENTENCE]).capitalize() + "."
+                for i in range(0, per_chunk, WORDS_PER_SENTENCE)
+            )
+
+
+def generate(n_chunks: int, n_questions: int = 200, seed: int = 0,
+             questions_path: str = "data/bench_questions.jsonl") -> Dict:
+    """
+    Write `n_chunks` synthetic chunks into ingest.DB_PATH (fresh chunks.db
+    schema) and `n_questions` queries built from the rarest terms of random
+    target chunks, with the target as the relevant chunk. Returns ingest timings.
+    """
+    vocab = make_vocab(seed=seed)
+    conn = ingest.init_db(full=True)
+    cur = conn.cursor()
+    writer = ingest.BulkChunkWriter(conn, defer_fts=True)
+
+    t0 = time.perf_counter()
+    doc_id = None
+    for i, text in enumerate(iter_chunk_texts(n_chunks, vocab, seed=seed)):
+        if i % CHUNKS_PER_DOC == 0:
+            n_doc = i // CHUNKS_PER_DOC
+            cur.execute(
+                "INSERT INTO docs (filename, title, url, file_sha1) VALUES (?, ?, ?, ?)",
+                (f"synthetic_{n_doc}.pdf", f"Synthetic document {n_doc}", f"synthetic://{n_doc}", None),
+            )
+            doc_id = cur.lastrowid
+        page = (i % CHUNKS_PER_DOC) // CHUNKS_PER_PAGE + 1
+        writer.insert(doc_id, text, sha1_hash(text), (page, page, None, None))
+    writer.flush()
+    insert_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    writer.finish()
+    conn.commit()
+    fts_s = time.perf_counter() - t0
+
+    # Questions: the 6 rarest distinct words of a random chunk (rank in vocab ~ rarity under Zipf)
+    rank = {w: r for r, w in enumerate(vocab)}
+    rng = random.Random(seed + 1)
+    all_ids = [r[0] for r in cur.execute("SELECT chunk_id FROM chunks")]
+    questions = []
+    for chunk_id in rng.sample(all_ids, min(n_questions, len(all_ids))):
+        cur.execute("SELECT chunk_text FROM chunks WHERE chunk_id = ?", (chunk_id,))
+        text = cur.fetchone()[0]
+        terms = sorted({w.strip(".").lower() for w in text.split()}, key=lambda w: -rank.get(w, 0))[:6]
+        questions.append({"q": " ".join(terms), "relevant": [chunk_id]})
+    conn.close()
+    with open(questions_path, "w", encoding="utf-8") as f:
+        for q in questions:
+            f.write(json.dumps(q) + "\n")
+
+    return {
+        "chunks": n_chunks,
+        "insert_s": insert_s,
+        "fts_rebuild_s": fts_s,
+        "chunks_per_s": n_chunks / max(insert_s + fts_s, 1e-9),
+    }
@@ -0,0 +1,231 @@
+# bench/run.py
+"""
+End-to-end benchmark on a synthetic corpus, written to a JSON file that can be
+diffed between runs:
+
+  ingest       synthetic chunks into chunks.db (+ FTS rebuild), chunks/s
+  index_build  embed, build the FAISS index, publish
+  quality      recall@k and MRR per mode against the planted answers
+  latency_ms   p50/p95/p99 per pipeline stage and end to end, per mode (sequential)
+  load         QPS and latency under concurrency, in process (through the
+               micro-batcher) or against a running server with --url
+
+Everything runs in --workdir (its own data/ directory), so the real index is
+never touched. --backend hash (default) needs no model download.
+
+  python -m bench.run --chunks 10000 --out bench_results.json
+  python -m bench.run --chunks 100000 --index "IVF1024,Flat" --nprobe 16 --out ivf.json
+  python -m bench.run --compare bench_results.json ivf.json
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+from typing import Dict, List
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+
+
+def build_index(factory: str, nprobe=None, ef_search=None) -> Dict:
+    import resource
+    import build_index as bi
+
+    out = {"factory": factory}
+    t0 = time.perf_counter()
+    index, chunk_ids, sha1s = bi.build_streaming(factory, resume=False)
+    out["embed_and_add_s"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    bi.publish(index, chunk_ids, sha1s, factory, nprobe=nprobe, ef_search=ef_search)
+    out["publish_s"] = time.perf_counter() - t0
+    out["vectors"] = int(index.ntotal)
+    out["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # Linux: KiB
+    return out
+
+
+def quality_and_latency(questions: List[Dict], modes: List[str], k: int) -> (Dict, Dict):
+    import api
+
+    quality, latency = {}, {}
+    for mode in modes:
+        hits, rr, stages, totals = 0, 0.0, {}, []
+        for item in questions:
+            req = api.AskRequest(item["q"], k, mode, debug_timings=True)
+            t0 = time.perf_counter()
+            response = api.answer_batch([req])[0]
+            totals.append((time.perf_counter() - t0) * 1000)
+            for stage, ms in response.get("debug_timings", {}).items():
+                if stage != "batch_size":
+                    stages.setdefault(stage, []).append(ms)
+            ranked = [c["chunk_id"] for c in response["contexts"]]
+            relevant = set(item["relevant"])
+            for rank, cid in enumerate(ranked, start=1):
+                if cid in relevant:
+                    hits += 1
+                    rr += 1.0 / rank
+                    break
+        n = max(len(questions), 1)
+        quality[mode] = {f"recall@{k}": hits / n, "mrr": rr / n}
+        latency[mode] = dict({stage: percentiles(v) for stage, v in stages.items()}, total=percentiles(totals))
+    return quality, latency
+
+
+def load_test(questions: List[Dict], mode: str, k: int, concurrency: int, requests: int, url=None) -> Dict:
+    if url is None:
+        import api
+
+        def call(q):
+            api.answer(api.AskRequest(q, k, mode))
+    else:
+        def call(q):
+            body = json.dumps({"q": q, "k": k, "mode": mode}).encode("utf-8")
+            req = urllib.request.Request(url.rstrip("/") + "/ask", data=body,
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                resp.read()
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                call(questions[i % len(questions)]["q"])
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return dict(percentiles(latencies), qps=len(latencies) / wall, errors=errors[0], requests=requests)
+
+
+def _rounded(obj):
+    if isinstance(obj, float):
+        return round(obj, 3)
+    if isinstance(obj, dict):
+        return {k: _rounded(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_rounded(v) for v in obj]
+    return obj
+
+
+def _flatten(obj, prefix=""):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from _flatten(v, f"{prefix}{k}.")
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix[:-1], obj
+
+
+def compare(old_path: str, new_path: str):
+    """Print every numeric result that changed, with the relative change."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = dict(_flatten(json.load(f)))
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = dict(_flatten(json.load(f)))
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key), new.get(key)
+        if a == b:
+            continue
+        change = f"{(b - a) / a * 100:+.1f}%" if a not in (None, 0) and b is not None else ""
+        print(f"{key:60s} {a!s:>12} -> {b!s:>12} {change}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="hash", help="INFERENCE_BACKEND for the run (hash = offline stand-ins)")
+    parser.add_argument("--index", default="Flat", help="FAISS factory string")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--modes", default="baseline,rerank,hybrid")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated client thread counts")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per concurrency level")
+    parser.add_argument("--url", default=None, help="Load-test a running server instead of in process")
+    parser.add_argument("--workdir", default="data/bench")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Must be set before the pipeline modules are imported
+    os.environ["INFERENCE_BACKEND"] = args.backend
+    os.environ.setdefault("QUERY_CACHE_SIZE", "0")  # measure the pipeline, not the cache
+    os.environ.setdefault("QUERY_EMBEDDING_MEMO", "0")  # every mode pays for its own encode
+    out_path = os.path.abspath(args.out)
+    shutil.rmtree(args.workdir, ignore_errors=True)
+    os.makedirs(os.path.join(args.workdir, "data"))
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    from bench import corpus
+    import faiss
+
+    modes = [m for m in args.modes.split(",") if m]
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "out", "workdir")},
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "faiss": faiss.__version__,
+        },
+    }
+    print(f"Generating {args.chunks} chunks ...")
+    results["ingest"] = corpus.generate(args.chunks, n_questions=args.questions, seed=args.seed)
+    print("Building index ...")
+    results["index_build"] = build_index(args.index, nprobe=args.nprobe, ef_search=args.ef_search)
+
+    with open("data/bench_questions.jsonl", "r", encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    print(f"Timing {len(questions)} questions x {modes} ...")
+    results["quality"], results["latency_ms"] = quality_and_latency(questions, modes, args.k)
+
+    results["load"] = {}
+    for mode in modes:
+        for c in [int(x) for x in args.concurrency.split(",") if x]:
+            print(f"Load: mode={mode} concurrency={c} ...")
+            results["load"][f"{mode}@{c}"] = load_test(questions, mode, args.k, c, args.requests, url=args.url)
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(_rounded(results), f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
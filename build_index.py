@@ -1,42 +1,410 @@
+import json
+import os
+import shutil
 import sqlite3
+import time
+from array import array
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+
+import sentences
+from chunk_store import write_artifact
+from embedding_cache import encode_cached
+from inference import LazyModel, embedding_key, load_bi_encoder
+from index_spec import (
+    SPEC_PATH, DEFAULT_FACTORY, build_faiss_index, load_spec, new_index, save_spec, search, supports_remove,
+)
 
 DB_PATH = "data/chunks.db"
 INDEX_PATH = "data/faiss_index.bin"
 MAPPING_PATH = "data/id_mapping.npy"
+# chunk_sha1 of every indexed chunk, aligned with MAPPING_PATH; lets incremental builds spot changed chunks
+SHA1_PATH = "data/id_sha1.npy"
+GENERATION_PATH = "data/index_generation.txt"
+# Full builds stream the chunks table in batches of BUILD_BATCH_SIZE and save a resumable
+# checkpoint to CHECKPOINT_DIR every CHECKPOINT_EVERY chunks
+BUILD_BATCH_SIZE = 2048
+CHECKPOINT_EVERY = 100000
+CHECKPOINT_DIR = "data/build_checkpoint"
+
+model = LazyModel(load_bi_encoder)
+
+
+def load_chunks(chunk_ids=None):
+    # Connect to sqlite
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    if chunk_ids is None:
+        cur.execute("SELECT chunk_id, chunk_sha1, chunk_text FROM chunks ORDER BY chunk_id")
+        rows = cur.fetchall()
+    else:
+        rows = []
+        ids = sorted(int(cid) for cid in chunk_ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join(["?"] * len(batch))
+            cur.execute(
+                f"SELECT chunk_id, chunk_sha1, chunk_text FROM chunks WHERE chunk_id IN ({placeholders}) ORDER BY chunk_id",
+                tuple(batch),
+            )
+            rows.extend(cur.fetchall())
+    conn.close()
+
+    chunk_ids = [r[0] for r in rows]
+    sha1s = [r[1] for r in rows]
+    texts = [r[2] for r in rows]
+    print(f"Loaded {len(texts)} chunks")
+    return chunk_ids, sha1s, texts
+
+
+def load_live_keys():
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT chunk_id, chunk_sha1 FROM chunks")
+    keys = {(int(cid), h) for cid, h in cur.fetchall()}
+    conn.close()
+    return keys
+
+
+def embed(texts, verbose=True):
+    # Only text this model has never embedded is encoded; the rest comes from data/emb_cache
+    embeddings = encode_cached(model.get(), embedding_key(), texts, batch_size=32, show_progress_bar=verbose)
+    faiss.normalize_L2(embeddings)  # cosine similarity via inner product after normalization
+    if verbose:
+        print("Embeddings generated:", embeddings.shape)
+    return embeddings
+
+
+def iter_chunk_batches(batch_size=BUILD_BATCH_SIZE, after_id=0):
+    """(chunk_ids, sha1s, texts) in chunk_id order, batch_size rows at a time (keyset pagination)."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(
+                "SELECT chunk_id, chunk_sha1, chunk_text FROM chunks WHERE chunk_id > ? ORDER BY chunk_id LIMIT ?",
+                (after_id, batch_size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]
+    finally:
+        conn.close()
+
+
+def training_sample(train_size):
+    """Embeddings of an evenly strided sample of at most train_size chunks."""
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM chunks")
+    step = max(1, cur.fetchone()[0] // max(train_size, 1))
+    cur.execute(
+        "SELECT chunk_text FROM (SELECT chunk_text, ROW_NUMBER() OVER (ORDER BY chunk_id) AS n FROM chunks) "
+        "WHERE n % ? = 0 LIMIT ?",
+        (step, train_size),
+    )
+    texts = [r[0] for r in cur.fetchall()]
+    conn.close()
+    return embed(texts)
+
+
+def _checkpoint_state(factory, ef_construction):
+    return {"factory": factory, "ef_construction": ef_construction, "embedding_key": embedding_key()}
+
+
+def save_checkpoint(index, chunk_ids, sha1s, state):
+    """Partial index + ids written to temp names and renamed; state.json goes last and marks it complete."""
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = lambda name: os.path.join(CHECKPOINT_DIR, name)
+    faiss.write_index(index, path("index.bin.tmp"))
+    os.replace(path("index.bin.tmp"), path("index.bin"))
+    with open(path("ids.npy.tmp"), "wb") as f:
+        np.save(f, np.frombuffer(chunk_ids, dtype="int64"))
+    os.replace(path("ids.npy.tmp"), path("ids.npy"))
+    with open(path("sha1.npy.tmp"), "wb") as f:
+        np.save(f, np.array(sha1s, dtype="S40"))
+    os.replace(path("sha1.npy.tmp"), path("sha1.npy"))
+    with open(path("state.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path("state.json.tmp"), path("state.json"))
+
+
+def load_checkpoint(factory, ef_construction):
+    """(index, chunk_ids, sha1s, last_chunk_id) from a checkpoint of the same build, or None."""
+    path = lambda name: os.path.join(CHECKPOINT_DIR, name)
+    try:
+        with open(path("state.json"), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if {k: state.get(k) for k in ("factory", "ef_construction", "embedding_key")} != \
+            _checkpoint_state(factory, ef_construction):
+        print("Ignoring checkpoint from a different index type or model")
+        return None
+    index = faiss.read_index(path("index.bin"))
+    chunk_ids = array("q", np.load(path("ids.npy")).tobytes())
+    sha1s = [h.decode("ascii") for h in np.load(path("sha1.npy"))]
+
+    # Chunks deleted (or changed: new chunk_id) since the checkpoint must leave the index
+    live = _live_keys_upto(state["last_chunk_id"])
+    gone = sorted(cid for cid, h in zip(chunk_ids, sha1s) if (cid, h) not in live)
+    if gone:
+        if not supports_remove(factory):
+            print(f"{len(gone)} checkpointed chunks changed and {factory} cannot remove vectors; starting over")
+            return None
+        index.remove_ids(np.array(gone, dtype="int64"))
+        gone_set = set(gone)
+        keep = [i for i, cid in enumerate(chunk_ids) if cid not in gone_set]
+        chunk_ids = array("q", (chunk_ids[i] for i in keep))
+        sha1s = [sha1s[i] for i in keep]
+    print(f"Resuming from checkpoint: {len(chunk_ids)} chunks indexed, up to chunk_id {state['last_chunk_id']}")
+    return index, chunk_ids, sha1s, state["last_chunk_id"]
+
+
+def _live_keys_upto(last_chunk_id):
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT chunk_id, chunk_sha1 FROM chunks WHERE chunk_id <= ?", (last_chunk_id,))
+    keys = {(int(cid), h) for cid, h in cur.fetchall()}
+    conn.close()
+    return keys
+
+
+def build_streaming(factory, batch_size=BUILD_BATCH_SIZE, train_size=50000, ef_construction=None,
+                    checkpoint_every=CHECKPOINT_EVERY, resume=True):
+    """
+    Full build that never holds more than one batch of texts and embeddings:
+    chunks are read, embedded and added batch by batch, and the partial index
+    is checkpointed every `checkpoint_every` chunks. With `resume`, a
+    checkpoint of the same factory and model is picked up where it stopped.
+    Returns (index, chunk_ids, sha1s); the checkpoint is removed by publish().
+    """
+    checkpoint = load_checkpoint(factory, ef_construction) if resume else None
+    if checkpoint is not None:
+        index, chunk_ids, sha1s, last_id = checkpoint
+    else:
+        shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+        dim = model.get().get_sentence_embedding_dimension()
+        sample = None
+        if not faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT).is_trained:
+            sample = training_sample(train_size)
+        index = new_index(factory, dim, train_sample=sample, ef_construction=ef_construction)
+        del sample
+        chunk_ids, sha1s, last_id = array("q"), [], 0
+
+    state = _checkpoint_state(factory, ef_construction)
+    since_checkpoint = added = 0
+    t0 = time.perf_counter()
+    for ids, hashes, texts in iter_chunk_batches(batch_size, after_id=last_id):
+        index.add_with_ids(embed(texts, verbose=False), np.array(ids, dtype="int64"))
+        chunk_ids.extend(ids)
+        sha1s.extend(hashes)
+        last_id = ids[-1]
+        since_checkpoint += len(ids)
+        added += len(ids)
+        if since_checkpoint >= checkpoint_every:
+            save_checkpoint(index, chunk_ids, sha1s, dict(state, last_chunk_id=last_id))
+            since_checkpoint = 0
+            rate = added / max(time.perf_counter() - t0, 1e-9)
+            print(f"Checkpoint: {len(chunk_ids)} chunks indexed ({rate:.0f} chunks/s this run)")
+    return index, list(chunk_ids), sha1s
+
+
+def publish(index, chunk_ids, sha1s, factory, nprobe=None, ef_search=None, ef_construction=None,
+            chunk_artifact=True, sentence_embeddings=False):
+    # Write to temp files and rename so a running server never reads a half-written file.
+    # The generation file goes last: the API reloads only once it changes.
+    faiss.write_index(index, INDEX_PATH + ".tmp")
+    os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+    with open(MAPPING_PATH + ".tmp", "wb") as f:
+        np.save(f, np.array(chunk_ids, dtype="int64"))
+    os.replace(MAPPING_PATH + ".tmp", MAPPING_PATH)
+    with open(SHA1_PATH + ".tmp", "wb") as f:
+        np.save(f, np.array(sha1s, dtype="U40"))
+    os.replace(SHA1_PATH + ".tmp", SHA1_PATH)
+    save_spec(SPEC_PATH + ".tmp", factory, index, nprobe=nprobe, ef_search=ef_search, ef_construction=ef_construction)
+    os.replace(SPEC_PATH + ".tmp", SPEC_PATH)
+    generation = str(time.time_ns())
+    if chunk_artifact:
+        # Memory-mapped text/metadata arrays for CHUNK_STORE=mmap serving
+        n = write_artifact(generation, db_path=DB_PATH)
+        print(f"Chunk artifact ({n} chunks) saved")
+    if sentence_embeddings:
+        n = write_sentence_embeddings(generation)
+        print(f"Sentence embeddings ({n} sentences) saved to {sentences.SENTENCE_EMB_DIR}")
+    with open(GENERATION_PATH + ".tmp", "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(GENERATION_PATH + ".tmp", GENERATION_PATH)
+    shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+    print("Index saved to", INDEX_PATH)
+    print("ID mapping saved to", MAPPING_PATH)
+    print("Index spec saved to", SPEC_PATH)
+
+
+def write_sentence_embeddings(generation, batch_size=BUILD_BATCH_SIZE, out_dir=sentences.SENTENCE_EMB_DIR):
+    """
+    Embed every sentence of every chunk for SNIPPET_MODE=embedding (see
+    sentences.SentenceEmbeddings). Goes through the embedding cache, so a
+    rebuild only encodes sentences it has not seen before.
+    """
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    chunk_ids, offsets = array("q"), array("q", [0])
+    dim = None
+    with open(os.path.join(tmp_dir, "vectors.f16"), "wb") as out:
+        for ids, _, texts in iter_chunk_batches(batch_size):
+            per_chunk = [[text[s:e] for s, e in sentences.split_spans(text)] for text in texts]
+            flat = [sent for sents in per_chunk for sent in sents]
+            if flat:
+                vectors = embed(flat, verbose=False)
+                dim = vectors.shape[1]
+                out.write(vectors.astype("float16").tobytes())
+            for cid, sents in zip(ids, per_chunk):
+                chunk_ids.append(cid)
+                offsets.append(offsets[-1] + len(sents))
+    np.save(os.path.join(tmp_dir, "chunk_ids.npy"), np.frombuffer(chunk_ids, dtype="int64"))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.frombuffer(offsets, dtype="int64"))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "embedding_key": embedding_key(), "dim": dim or 0,
+                   "n_sentences": offsets[-1]}, f)
+
+    old_dir = out_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return offsets[-1]
+
+
+def can_update_incrementally(factory):
+    if not all(os.path.exists(p) for p in (INDEX_PATH, MAPPING_PATH, SHA1_PATH)):
+        return False
+    spec = load_spec()
+    # Only indexes keyed by chunk_id support add_with_ids / remove_ids
+    return spec.get("labels") == "chunk_id" and spec.get("factory") == factory
+
+
+def update_incrementally(factory):
+    """
+    Diff the indexed (chunk_id, chunk_sha1) pairs against the chunks table:
+    vectors of chunks that were deleted or changed are removed, and only new
+    or changed chunks are embedded and added. Returns None when the index
+    type cannot remove vectors and a full rebuild is needed instead.
+    """
+    indexed_ids = np.load(MAPPING_PATH)
+    indexed_sha1s = np.load(SHA1_PATH)
+    indexed = {(int(cid), str(h)) for cid, h in zip(indexed_ids, indexed_sha1s)}
+    live = load_live_keys()
+
+    to_remove = sorted({cid for cid, _ in indexed - live})
+    to_add = sorted({cid for cid, _ in live - indexed})
+    print(f"Incremental update: {len(to_add)} chunks to add, {len(to_remove)} to remove")
+    if to_remove and not supports_remove(factory):
+        print(f"{factory} cannot remove vectors; falling back to a full rebuild")
+        return None
+
+    index = faiss.read_index(INDEX_PATH)
+    if to_remove:
+        index.remove_ids(np.array(to_remove, dtype="int64"))
+    for start in range(0, len(to_add), BUILD_BATCH_SIZE):
+        add_ids, _, add_texts = load_chunks(to_add[start:start + BUILD_BATCH_SIZE])
+        index.add_with_ids(embed(add_texts), np.array(add_ids, dtype="int64"))
+
+    keys = sorted(live)
+    return index, [cid for cid, _ in keys], [h for _, h in keys]
+
+
+def recall_report(embeddings, factories, k=10, n_queries=200, nprobe=None, ef_search=None,
+                  ef_construction=None, train_size=50000, seed=42):
+    """Compare recall@k and query latency of candidate index specs against the exact Flat index."""
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)]
+
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+
+    print(f"\n{'spec':<24} {'recall@' + str(k):>10} {'build_s':>9} {'ms/query':>9}")
+    for factory in factories:
+        t0 = time.perf_counter()
+        index = build_faiss_index(factory, embeddings, train_size=train_size, ef_construction=ef_construction, seed=seed)
+        build_s = time.perf_counter() - t0
+
+        spec = {"factory": factory}
+        t0 = time.perf_counter()
+        _, found = search(index, spec, queries, k, nprobe=nprobe, ef_search=ef_search)
+        ms_per_query = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        hits = sum(len(set(t) & set(f[f >= 0])) for t, f in zip(truth, found))
+        recall = hits / float(truth.size)
+        print(f"{factory:<24} {recall:>10.4f} {build_s:>9.2f} {ms_per_query:>9.3f}")
 
-# Connect to sqlite
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
-cur.execute("SELECT chunk_id, chunk_text FROM chunks")
-rows = cur.fetchall()
-conn.close()
 
-chunk_ids = [r[0] for r in rows]
-texts = [r[1] for r in rows]
-print(f"Loaded {len(texts)} chunks")
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default=None,
+                        help='FAISS factory string, e.g. "Flat", "IVF1024,Flat", "HNSW32", "IVF1024,PQ16" '
+                             "(default: the current index type, or Flat)")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every chunk instead of updating the existing index in place")
+    parser.add_argument("--no-chunk-artifact", action="store_true",
+                        help="Skip writing data/chunk_artifact (only needed for CHUNK_STORE=mmap serving)")
+    parser.add_argument("--sentence-embeddings", action="store_true",
+                        help="Also embed every sentence into data/sentence_embeddings (for SNIPPET_MODE=embedding)")
+    parser.add_argument("--nprobe", type=int, default=None, help="Default nprobe stored in the spec (IVF)")
+    parser.add_argument("--ef-search", type=int, default=None, help="Default efSearch stored in the spec (HNSW)")
+    parser.add_argument("--ef-construction", type=int, default=None, help="efConstruction used while building (HNSW)")
+    parser.add_argument("--train-size", type=int, default=50000, help="Max vectors sampled to train IVF/PQ")
+    parser.add_argument("--batch-size", type=int, default=BUILD_BATCH_SIZE, help="Chunks read and embedded at a time")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="Save a resumable checkpoint of a full build every N chunks")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing build checkpoint")
+    parser.add_argument("--benchmark", nargs="+", metavar="SPEC",
+                        help="Only report recall@k of these specs against exact Flat; does not write an index")
+    parser.add_argument("--recall-k", type=int, default=10)
+    parser.add_argument("--recall-queries", type=int, default=200)
+    args = parser.parse_args()
 
+    if args.benchmark:
+        _, _, texts = load_chunks()
+        recall_report(
+            embed(texts), args.benchmark, k=args.recall_k, n_queries=args.recall_queries,
+            nprobe=args.nprobe, ef_search=args.ef_search, ef_construction=args.ef_construction,
+            train_size=args.train_size,
+        )
+        return
 
-# Generate embeddings
+    spec = load_spec()
+    factory = args.index or spec.get("factory", DEFAULT_FACTORY)
+    # Keep search defaults from the previous build unless overridden
+    nprobe = args.nprobe if args.nprobe is not None else spec.get("nprobe")
+    ef_search = args.ef_search if args.ef_search is not None else spec.get("ef_search")
+    ef_construction = args.ef_construction if args.ef_construction is not None else spec.get("ef_construction")
 
-model = SentenceTransformer("all-mpnet-base-v2")
-embeddings = model.encode(texts, show_progress_bar=True, batch_size=32)
-embeddings = np.array(embeddings).astype("float32")  
-print("Embeddings generated:", embeddings.shape)
+    updated = None
+    if not args.full and can_update_incrementally(factory):
+        updated = update_incrementally(factory)
 
-# Build FAISS index
+    if updated is not None:
+        index, chunk_ids, sha1s = updated
+    else:
+        # Build FAISS index batch by batch, resuming an interrupted build
+        index, chunk_ids, sha1s = build_streaming(
+            factory, batch_size=args.batch_size, train_size=args.train_size, ef_construction=ef_construction,
+            checkpoint_every=args.checkpoint_every, resume=not args.no_resume,
+        )
+    print(f"FAISS index ({factory}) has", index.ntotal, "vectors")
 
-dim = embeddings.shape[1]
-index = faiss.IndexFlatIP(dim)  # cosine similarity via inner product after normalization
-faiss.normalize_L2(embeddings)
-index.add(embeddings)
-print("FAISS index built with", index.ntotal, "vectors")
+    # Save index and mapping
+    publish(index, chunk_ids, sha1s, factory, nprobe=nprobe, ef_search=ef_search,
+            ef_construction=ef_construction, chunk_artifact=not args.no_chunk_artifact,
+            sentence_embeddings=args.sentence_embeddings)
 
-# Save index and mapping
 
-faiss.write_index(index, INDEX_PATH)
-np.save(MAPPING_PATH, np.array(chunk_ids))
-print("Index saved to", INDEX_PATH)
-print("ID mapping saved to", MAPPING_PATH)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# check_startup.py
+"""
+Import-time budget: importing the serving and eval modules must not load any
+model or pull in torch. Each module is imported in a fresh interpreter.
+
+  python check_startup.py               # exits 1 if a module is over budget
+  python check_startup.py --budget 1.5 api eval
+"""
+import json
+import subprocess
+import sys
+
+MODULES = ["api", "asgi_app", "rerank", "eval", "search_baseline"]
+# Importing any of these means a model loaded (or is about to) at import time
+HEAVY = ["torch", "sentence_transformers", "transformers", "sklearn", "joblib"]
+IMPORT_BUDGET_S = 2.0
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - t0,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    proc = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_S, help="Seconds allowed per import")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        result = measure(module)
+        if "error" in result:
+            ok = False
+            detail = result["error"]
+        else:
+            ok = result["seconds"] <= args.budget and not result["heavy"]
+            detail = f"{result['seconds']:.2f}s" + (f", loaded {', '.join(result['heavy'])}" if result["heavy"] else "")
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {detail}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,365 @@
+# chunk_store.py
+import json
+import mmap
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sentences
+
+DB_PATH = "data/chunks.db"
+# Written by build_index.py; served instead of SQLite when CHUNK_STORE=mmap
+ARTIFACT_DIR = "data/chunk_artifact"
+CHUNK_STORE = os.environ.get("CHUNK_STORE", "sqlite")  # "sqlite" | "mmap"
+POOL_SIZE = 8
+MMAP_SIZE = 256 * 1024 * 1024
+# SQLite's default limit on host parameters is 999 on older builds
+MAX_PARAMS = 900
+
+
+class _PooledConnection(sqlite3.Connection):
+    # Columns of the chunks table, read once per connection by _chunk_columns()
+    chunk_columns: frozenset = frozenset()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of read-only SQLite connections. Connections are opened
+    lazily, marked query_only, and memory-map the DB file. The DB itself is
+    put in WAL mode by ingest.py, so reads never block on a running ingest.
+    """
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _reset(self):
+        # In a forked worker: never reuse the parent's connections
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue()
+                self._opened = 0
+                self._pid = os.getpid()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=_PooledConnection)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA cache_size=-16384")  # 16 MiB per connection
+        return conn
+
+    @contextmanager
+    def connection(self):
+        if self._pid != os.getpid():
+            self._reset()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    conn = self._open()
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+
+pool = ConnectionPool()
+
+
+def _batches(ids: List[int]):
+    for start in range(0, len(ids), MAX_PARAMS):
+        yield ids[start:start + MAX_PARAMS]
+
+
+def _column(cur: sqlite3.Cursor, column: str, table: str = "chunks") -> str:
+    """`column`, or NULL when the table predates it (chunks.db not re-ingested since the column was added)."""
+    columns = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    return column if column in columns else "NULL"
+
+
+def _chunk_columns(conn: _PooledConnection) -> frozenset:
+    """Columns of the chunks table on a pooled connection, without a PRAGMA per fetch.
+    Re-read while empty, so a server started before the first ingest picks them up."""
+    if not conn.chunk_columns:
+        conn.chunk_columns = frozenset(row[1] for row in conn.execute("PRAGMA table_info(chunks)"))
+    return conn.chunk_columns
+
+
+def fetch_chunks(chunk_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """chunk_id -> {"text", "doc_id", "title", "url", "page"} in one query per 900 ids."""
+    ids = list({int(cid) for cid in chunk_ids})
+    if not ids:
+        return {}
+    if CHUNK_STORE == "mmap":
+        store = get_mmap_store()
+        if store is not None:
+            return store.fetch_chunks(ids)
+    out = {}
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        page_start = "c.page_start" if "page_start" in _chunk_columns(conn) else "NULL"
+        for batch in _batches(ids):
+            placeholders = ",".join(["?"] * len(batch))
+            cur.execute(
+                f"""
+                SELECT c.chunk_id, c.chunk_text, c.doc_id, d.title, d.url, {page_start}
+                FROM chunks c
+                LEFT JOIN docs d ON c.doc_id = d.doc_id
+                WHERE c.chunk_id IN ({placeholders})
+                """,
+                tuple(batch),
+            )
+            for cid, text, doc_id, title, url, page in cur.fetchall():
+                out[int(cid)] = {"text": text, "doc_id": doc_id, "title": title, "url": url, "page": page}
+    return out
+
+
+def fetch_sentence_index(chunk_ids: List[int]) -> Dict[int, Tuple[str, sentences.SentenceIndex]]:
+    """chunk_id -> (full text, sentence index); chunks ingested before the index existed are split on the fly."""
+    ids = list({int(cid) for cid in chunk_ids})
+    if not ids:
+        return {}
+    if CHUNK_STORE == "mmap":
+        store = get_mmap_store()
+        if store is not None and store.has_sentences:
+            return store.fetch_sentence_index(ids)
+    rows = []
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        sentence_col = "sentence_index" if "sentence_index" in _chunk_columns(conn) else "NULL"
+        for batch in _batches(ids):
+            placeholders = ",".join(["?"] * len(batch))
+            cur.execute(
+                f"SELECT chunk_id, chunk_text, {sentence_col} FROM chunks WHERE chunk_id IN ({placeholders})",
+                tuple(batch),
+            )
+            rows.extend(cur.fetchall())
+    return {
+        int(cid): (text, sentences.unpack(blob) if blob else sentences.build(text))
+        for cid, text, blob in rows
+    }
+
+
+def to_fts_query(raw: str) -> str:
+    # Keep only alphanumeric tokens; join with OR to avoid FTS syntax errors
+    tokens = re.findall(r"[A-Za-z0-9]+", raw.lower())
+    # If empty after cleaning, return a token that won't match anything
+    if not tokens:
+        return "__nomatch__"
+    return " OR ".join(tokens)
+
+
+def fts_search(query: str, top_k: int = 50) -> List[tuple]:
+    """Top-k (chunk_id, bm25_score) over the whole FTS5 index, best first (higher is better)."""
+    fts_query = to_fts_query(query)
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT rowid, bm25(chunks_fts) as score
+            FROM chunks_fts
+            WHERE chunks_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            (fts_query, int(top_k)),
+        )
+        return [(int(rowid), -float(score)) for rowid, score in cur.fetchall()]
+
+
+def bm25_scores(query: str, chunk_ids: List[int]) -> Dict[int, float]:
+    ids = list({int(cid) for cid in chunk_ids})
+    if not ids:
+        return {}
+    fts_query = to_fts_query(query)
+    out = {}
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        # Use FTS5 BM25 ranking via rank function. We restrict by rowid IN (...)
+        for batch in _batches(ids):
+            placeholders = ",".join(["?"] * len(batch))
+            cur.execute(
+                f"""
+                SELECT rowid, bm25(chunks_fts) as score
+                FROM chunks_fts
+                WHERE chunks_fts MATCH ?
+                AND rowid IN ({placeholders})
+                """,
+                tuple([fts_query] + batch),
+            )
+            # FTS bm25: lower is better (since it's a distance). Convert to descending score with negative.
+            out.update({int(rowid): -float(score) for rowid, score in cur.fetchall()})
+    return out
+
+
+class MmapChunkStore:
+    """
+    Read-only chunk store over the artifact written by write_artifact():
+
+      text.bin      all chunk texts as one contiguous UTF-8 blob
+      offsets.npy   int64[n + 1], byte range of chunk i is offsets[i]:offsets[i + 1]
+      chunk_ids.npy int64[n], sorted
+      doc_idx.npy   int32[n], row in docs.json
+      pages.npy     int32[n], page_start (-1 if unknown)
+      docs.json     [{"doc_id", "title", "url"}, ...]
+      sentences.bin packed sentence index of every chunk (see sentences.py)
+      sent_offsets.npy int64[n + 1], byte range of chunk i in sentences.bin
+      manifest.json {"generation", "n_chunks"}, written last
+
+    Arrays are memory-mapped, so worker processes share the same pages and a
+    lookup is a searchsorted plus a slice.
+    """
+
+    def __init__(self, path: str = ARTIFACT_DIR):
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.generation = self.manifest["generation"]
+        self.chunk_ids = np.load(os.path.join(path, "chunk_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.doc_idx = np.load(os.path.join(path, "doc_idx.npy"), mmap_mode="r")
+        self.pages = np.load(os.path.join(path, "pages.npy"), mmap_mode="r")
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            self.docs = json.load(f)
+        self.blob = _map_file(os.path.join(path, "text.bin"))
+        # Artifacts written before the sentence index existed lack these
+        self.has_sentences = os.path.exists(os.path.join(path, "sent_offsets.npy"))
+        if self.has_sentences:
+            self.sent_offsets = np.load(os.path.join(path, "sent_offsets.npy"), mmap_mode="r")
+            self.sent_blob = _map_file(os.path.join(path, "sentences.bin"))
+
+    def _positions(self, chunk_ids: List[int]):
+        if not len(self.chunk_ids):
+            return []
+        ids = np.asarray(chunk_ids, dtype="int64")
+        pos = np.minimum(np.searchsorted(self.chunk_ids, ids), len(self.chunk_ids) - 1)
+        found = self.chunk_ids[pos] == ids
+        return zip(ids[found].tolist(), pos[found].tolist())
+
+    def _text(self, i: int) -> str:
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def fetch_chunks(self, chunk_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        out = {}
+        for cid, i in self._positions(chunk_ids):
+            doc = self.docs[int(self.doc_idx[i])]
+            page = int(self.pages[i])
+            out[cid] = {
+                "text": self._text(i),
+                "doc_id": doc["doc_id"],
+                "title": doc["title"],
+                "url": doc["url"],
+                "page": page if page >= 0 else None,
+            }
+        return out
+
+    def fetch_sentence_index(self, chunk_ids: List[int]) -> Dict[int, Tuple[str, sentences.SentenceIndex]]:
+        return {
+            cid: (self._text(i), sentences.unpack(self.sent_blob[int(self.sent_offsets[i]):int(self.sent_offsets[i + 1])]))
+            for cid, i in self._positions(chunk_ids)
+        }
+
+
+def _map_file(path: str):
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_mmap_store = None
+_mmap_checked = 0.0
+_mmap_lock = threading.Lock()
+
+
+def get_mmap_store(check_interval: float = 1.0) -> Optional[MmapChunkStore]:
+    """The current artifact, reopened when build_index.py writes a new generation; None if missing."""
+    global _mmap_store, _mmap_checked
+    now = time.monotonic()
+    if _mmap_store is not None and now - _mmap_checked < check_interval:
+        return _mmap_store
+    with _mmap_lock:
+        _mmap_checked = now
+        manifest_path = os.path.join(ARTIFACT_DIR, "manifest.json")
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                generation = json.load(f)["generation"]
+            if _mmap_store is None or _mmap_store.generation != generation:
+                _mmap_store = MmapChunkStore(ARTIFACT_DIR)
+        except (OSError, ValueError, KeyError):
+            # Mid-swap or never built: keep serving the last good artifact (or fall back to SQLite)
+            pass
+        return _mmap_store
+
+
+def write_artifact(generation: str, db_path: str = DB_PATH, out_dir: str = ARTIFACT_DIR) -> int:
+    """Stream the chunks table into a fresh artifact directory and swap it into place."""
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT doc_id, title, url FROM docs ORDER BY doc_id")
+    docs = [{"doc_id": d, "title": t, "url": u} for d, t, u in cur.fetchall()]
+    doc_row = {d["doc_id"]: i for i, d in enumerate(docs)}
+    docs.append({"doc_id": None, "title": None, "url": None})  # chunks whose doc row is gone
+
+    chunk_ids, doc_idx, pages, offsets = array("q"), array("i"), array("i"), array("q", [0])
+    sent_offsets = array("q", [0])
+    sentence_col = _column(cur, "sentence_index")
+    with open(os.path.join(tmp_dir, "text.bin"), "wb") as blob, \
+            open(os.path.join(tmp_dir, "sentences.bin"), "wb") as sent_blob:
+        cur.execute(f"SELECT chunk_id, doc_id, {_column(cur, 'page_start')}, chunk_text, {sentence_col} "
+                    "FROM chunks ORDER BY chunk_id")
+        while True:
+            rows = cur.fetchmany(5000)
+            if not rows:
+                break
+            for cid, doc_id, page, text, sent_index in rows:
+                data = text.encode("utf-8")
+                blob.write(data)
+                chunk_ids.append(cid)
+                doc_idx.append(doc_row.get(doc_id, len(docs) - 1))
+                pages.append(page if page is not None else -1)
+                offsets.append(offsets[-1] + len(data))
+                sent_index = sent_index or sentences.pack(sentences.build(text))
+                sent_blob.write(sent_index)
+                sent_offsets.append(sent_offsets[-1] + len(sent_index))
+    conn.close()
+
+    np.save(os.path.join(tmp_dir, "chunk_ids.npy"), np.frombuffer(chunk_ids, dtype="int64"))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.frombuffer(offsets, dtype="int64"))
+    np.save(os.path.join(tmp_dir, "doc_idx.npy"), np.frombuffer(doc_idx, dtype="int32"))
+    np.save(os.path.join(tmp_dir, "pages.npy"), np.frombuffer(pages, dtype="int32"))
+    np.save(os.path.join(tmp_dir, "sent_offsets.npy"), np.frombuffer(sent_offsets, dtype="int64"))
+    with open(os.path.join(tmp_dir, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "n_chunks": len(chunk_ids)}, f)
+
+    # Open readers keep their (unlinked) files; new readers see the new directory
+    old_dir = out_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(chunk_ids)
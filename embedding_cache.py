@@ -0,0 +1,165 @@
+# embedding_cache.py
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Sequence
+
+import numpy as np
+
+from utils import sha1_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, one writer process only
+    fcntl = None
+
+CACHE_DIR = "data/emb_cache"
+# float16 halves the cache size at ~1e-3 cosine drift; float32 matches fresh encodes
+CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding cache for one model.
+
+    Vectors live in an append-only memory-mapped matrix
+    (data/emb_cache/<model>.<dtype>.bin); a small SQLite table maps
+    (sha1, model) -> row. Vectors are stored L2-normalized.
+
+    Several processes may share the cache (features.py --workers, a build
+    next to a server): appends hold an flock on <matrix>.lock and take the
+    next row from the file size, not from this process's view of it.
+    """
+
+    def __init__(self, model_name: str, dim: int, dtype: str = CACHE_DTYPE, cache_dir: str = CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.matrix_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.bin")
+        self.lock_path = self.matrix_path + ".lock"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                sha1 TEXT,
+                model TEXT,
+                dtype TEXT,
+                row INTEGER,
+                PRIMARY KEY (sha1, model, dtype)
+            )
+            """
+        )
+        self._conn.commit()
+        self._rows = self._count_rows()
+        self._mmap = None
+
+    def _count_rows(self) -> int:
+        if not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (self.dim * self.dtype.itemsize)
+
+    def _matrix(self) -> np.ndarray:
+        if self._mmap is None or self._mmap.shape[0] != self._rows:
+            self._mmap = np.memmap(self.matrix_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))
+        return self._mmap
+
+    def lookup(self, hashes: Sequence[str]) -> dict:
+        """sha1 -> row for the hashes already stored for this model."""
+        found = {}
+        unique = list(set(hashes))
+        cur = self._conn.cursor()
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join(["?"] * len(batch))
+            cur.execute(
+                f"SELECT sha1, row FROM embeddings WHERE model = ? AND dtype = ? AND sha1 IN ({placeholders})",
+                tuple([self.model_name, self.dtype.name] + batch),
+            )
+            found.update(cur.fetchall())
+        return found
+
+    def get(self, rows: Sequence[int]) -> np.ndarray:
+        if not len(rows):
+            return np.zeros((0, self.dim), dtype="float32")
+        if max(rows) >= self._rows:
+            # Appended by another process since we last looked
+            self._rows = self._count_rows()
+        return np.asarray(self._matrix()[np.asarray(rows, dtype="int64")], dtype="float32")
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def put(self, hashes: Sequence[str], vectors: np.ndarray) -> List[int]:
+        with self._write_lock():
+            start = self._count_rows()
+            with open(self.matrix_path, "ab") as f:
+                # Drop a partially written row left behind by an interrupted run
+                f.truncate(start * self.dim * self.dtype.itemsize)
+                f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+            rows = list(range(start, start + len(hashes)))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (sha1, model, dtype, row) VALUES (?, ?, ?, ?)",
+                [(h, self.model_name, self.dtype.name, r) for h, r in zip(hashes, rows)],
+            )
+            self._conn.commit()
+            self._rows = start + len(hashes)
+            return rows
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model_name: str, dim: int, dtype: str = CACHE_DTYPE) -> EmbeddingStore:
+    key = (model_name, dim, dtype)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(model_name, dim, dtype=dtype)
+        return _stores[key]
+
+
+def encode_cached(model, model_name: str, texts: Sequence[str], batch_size: int = 32,
+                  show_progress_bar: bool = False, dtype: str = CACHE_DTYPE) -> np.ndarray:
+    """
+    Normalized float32 embeddings for `texts`, encoding only text this model
+    has never embedded before. Duplicate texts are encoded once.
+    """
+    dim = model.get_sentence_embedding_dimension()
+    if not len(texts):
+        return np.zeros((0, dim), dtype="float32")
+    store = get_store(model_name, dim, dtype=dtype)
+    hashes = [sha1_hash(t) for t in texts]
+    known = store.lookup(hashes)
+
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in known and h not in missing:
+            missing[h] = t
+    if show_progress_bar:
+        print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} to encode ({model_name})")
+    if missing:
+        new_vecs = model.encode(list(missing.values()), show_progress_bar=show_progress_bar, batch_size=batch_size)
+        rows = store.put(list(missing.keys()), _normalize(new_vecs))
+        known.update(zip(missing.keys(), rows))
+
+    return _normalize(store.get([known[h] for h in hashes]))
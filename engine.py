@@ -0,0 +1,112 @@
+# engine.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import index_spec
+import metrics
+from inference import LazyModel, load_bi_encoder
+
+INDEX_PATH = "data/faiss_index.bin"
+MAPPING_PATH = "data/id_mapping.npy"
+# Written by build_index.py after the index and mapping are in place
+GENERATION_PATH = "data/index_generation.txt"
+# Recent query embeddings kept so a query encoded for the semantic cache is not encoded again to search
+QUERY_EMBEDDING_MEMO = int(os.environ.get("QUERY_EMBEDDING_MEMO", 256))
+
+
+class IndexSnapshot:
+    """An immutable (index, id mapping, spec) triple loaded from one build generation."""
+
+    def __init__(self, index, id_mapping: np.ndarray, spec: dict, generation: str):
+        self.index = index
+        self.id_mapping = id_mapping
+        self.spec = spec
+        self.generation = generation
+
+
+def current_generation() -> str:
+    if os.path.exists(GENERATION_PATH):
+        with open(GENERATION_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    # Indexes built before generation files existed: fall back to mtimes
+    return f"{os.path.getmtime(INDEX_PATH)}:{os.path.getmtime(MAPPING_PATH)}"
+
+
+class RetrievalEngine:
+    """
+    Keeps the FAISS index, id mapping and query encoder resident for the
+    lifetime of the process. The index is swapped atomically when
+    build_index.py publishes a new generation; each search works on the
+    snapshot it grabbed, so in-flight requests keep the old index.
+    """
+
+    def __init__(self, encoder=None, check_interval: float = 1.0):
+        # A model, or a LazyModel that loads it on the first encode
+        self._encoder = encoder if encoder is not None else LazyModel(load_bi_encoder)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._last_check = 0.0
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        if isinstance(self._encoder, LazyModel):
+            return self._encoder.get()
+        return self._encoder
+
+    @property
+    def generation(self) -> Optional[str]:
+        """Generation currently loaded, without loading anything."""
+        snap = self._snapshot
+        return snap.generation if snap is not None else None
+
+    def snapshot(self) -> IndexSnapshot:
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is not None and now - self._last_check < self.check_interval:
+            return snap
+        with self._lock:
+            self._last_check = now
+            generation = current_generation()
+            if self._snapshot is None or self._snapshot.generation != generation:
+                spec = index_spec.load_spec()
+                index = index_spec.read_index(INDEX_PATH, spec)
+                id_mapping = np.load(MAPPING_PATH, mmap_mode="r" if index_spec.FAISS_MMAP else None)
+                self._snapshot = IndexSnapshot(index, id_mapping, spec, generation)
+            return self._snapshot
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        with self._memo_lock:
+            found = {q: self._memo[q] for q in queries if q in self._memo}
+        missing = list(dict.fromkeys(q for q in queries if q not in found))
+        if missing:
+            with metrics.span("encode"):
+                q_emb = np.array(self.encoder.encode(missing, normalize_embeddings=True)).astype("float32")
+            found.update(zip(missing, q_emb))
+            with self._memo_lock:
+                for q, emb in zip(missing, q_emb):
+                    self._memo[q] = emb
+                    self._memo.move_to_end(q)
+                while len(self._memo) > QUERY_EMBEDDING_MEMO:
+                    self._memo.popitem(last=False)
+        return np.stack([found[q] for q in queries]).astype("float32", copy=False)
+
+    def search(self, query: str, top_k: int = 20, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self.search_batch([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 20, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        # One encode call and one multi-row FAISS search for all queries
+        snap = self.snapshot()
+        q_emb = self.encode(queries)
+        with metrics.span("index_search"):
+            D, I = index_spec.search(snap.index, snap.spec, q_emb, top_k, nprobe=nprobe, ef_search=ef_search)
+        return [index_spec.hits(snap.spec, snap.id_mapping, D[row], I[row]) for row in range(len(queries))]
@@ -1,14 +1,30 @@
 import json
 import csv
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
+import numpy as np
+
 from rerank import fetch_candidates_faiss as fetch_candidates
+from rerank import fetch_candidates_faiss_batch as fetch_candidates_batch
 from rerank import rerank as rerank_candidates
-from features import _to_fts_query  
+from rerank import rerank_batch
+
+MODES = ("baseline", "rerank")
+ABSTAIN_THRESHOLDS = {"baseline": 0.30, "rerank": 0.45}
+EVAL_BATCH_SIZE = 32
+CANDIDATE_DEPTH = 50
 
 
 def run_mode(q: str, k: int, mode: str):
-    candidates = fetch_candidates(q, top_k=max(k, 50))
+    candidates = fetch_candidates(q, top_k=max(k, CANDIDATE_DEPTH))
+    return rank_mode(q, candidates, k, mode)
+
+
+def rank_mode(q: str, candidates, k: int, mode: str):
     if mode == "baseline":
         ranked = [
             {"chunk_id": int(cid), "score": float(score), "text": text}
@@ -22,35 +38,174 @@ def run_mode(q: str, k: int, mode: str):
         return reranked, top_score
 
 
-def evaluate(questions_path: str, out_csv: str, k: int = 5):
-    rows = []
+def load_questions(questions_path: str) -> List[Dict[str, Any]]:
     with open(questions_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if not line.strip():
-                continue
-            item = json.loads(line)
-            q = item["q"]
-
-            base_ranked, base_top = run_mode(q, k, mode="baseline")
-            rr_ranked, rr_top = run_mode(q, k, mode="rerank")
-
-            abstain_base = base_top < 0.30
-            abstain_rr = rr_top < 0.45
-
-            rows.append({
-                "question": q,
-                "baseline_top": f"{base_top:.3f}",
-                "baseline_abstain": abstain_base,
-                "rerank_top": f"{rr_top:.3f}",
-                "rerank_abstain": abstain_rr,
-            })
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ranking_metrics(ranked_ids: List[int], positives: set, negatives: set, k: int) -> Dict[str, float]:
+    """Binary-relevance recall@k, reciprocal rank, nDCG@k and the share of labeled negatives in the top-k."""
+    top = ranked_ids[:k]
+    rr = next((1.0 / rank for rank, cid in enumerate(top, start=1) if cid in positives), 0.0)
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, cid in enumerate(top, start=1) if cid in positives)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(positives), k) + 1))
+    return {
+        "recall": len(positives.intersection(top)) / len(positives),
+        "rr": rr,
+        "ndcg": dcg / ideal,
+        "neg_rate": sum(cid in negatives for cid in top) / float(k),
+    }
+
+
+def _evaluate_batch(items: List[Dict[str, Any]], k: int, nprobe=None, ef_search=None) -> List[Dict[str, Any]]:
+    # One retrieval per question, shared by every mode; stage times are amortized over the batch
+    queries = [item["q"] for item in items]
+    t0 = time.perf_counter()
+    candidates_list = fetch_candidates_batch(queries, top_k=max(k, CANDIDATE_DEPTH), nprobe=nprobe, ef_search=ef_search)
+    retrieve_ms = (time.perf_counter() - t0) * 1000 / len(items)
+
+    ranked = {"baseline": [rank_mode(q, cands, k, "baseline")[0] for q, cands in zip(queries, candidates_list)]}
+    t0 = time.perf_counter()
+    ranked["rerank"] = [r[:k] for r in rerank_batch(queries, candidates_list)]
+    rerank_ms = (time.perf_counter() - t0) * 1000 / len(items)
+    latency_ms = {"baseline": retrieve_ms, "rerank": retrieve_ms + rerank_ms}
+
+    results = []
+    for i, item in enumerate(items):
+        positives = {int(cid) for cid in item.get("positives", [])}
+        negatives = {int(cid) for cid in item.get("negatives", [])}
+        result = {"question": item["q"]}
+        for mode in MODES:
+            top = ranked[mode][i]
+            top_score = (top[0]["score"] if mode == "baseline" else top[0].get("rerank_score", 0.0)) if top else 0.0
+            result[f"{mode}_top"] = top_score
+            result[f"{mode}_abstain"] = top_score < ABSTAIN_THRESHOLDS[mode]
+            result[f"{mode}_ms"] = latency_ms[mode]
+            if positives:
+                ids = [r["chunk_id"] for r in top]
+                for name, value in ranking_metrics(ids, positives, negatives, k).items():
+                    result[f"{mode}_{name}"] = value
+        results.append(result)
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], k: int, wall_s: float) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for mode in MODES:
+        ms = [r[f"{mode}_ms"] for r in results]
+        labeled = [r for r in results if f"{mode}_rr" in r]
+        stats = {
+            "questions": len(results),
+            "labeled": len(labeled),
+            "abstain_rate": float(np.mean([r[f"{mode}_abstain"] for r in results])),
+            "mean_ms": float(np.mean(ms)),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "questions_per_s": len(results) / max(wall_s, 1e-9),
+        }
+        if labeled:
+            stats[f"recall@{k}"] = float(np.mean([r[f"{mode}_recall"] for r in labeled]))
+            stats["mrr"] = float(np.mean([r[f"{mode}_rr"] for r in labeled]))
+            stats[f"ndcg@{k}"] = float(np.mean([r[f"{mode}_ndcg"] for r in labeled]))
+            stats[f"neg@{k}"] = float(np.mean([r[f"{mode}_neg_rate"] for r in labeled]))
+        summary[mode] = stats
+    return summary
+
+
+def evaluate(questions_path: str, out_csv: str, k: int = 5, batch_size: int = EVAL_BATCH_SIZE,
+             workers: int = 1, nprobe=None, ef_search=None, summary_out=None) -> Dict[str, Dict[str, float]]:
+    """
+    Baseline and rerank on every question from one shared candidate fetch,
+    `batch_size` questions per retrieval call and `workers` batches in flight.
+    Per-question rows go to out_csv; the per-mode summary (recall@k, MRR,
+    nDCG@k over the labeled questions, latency, throughput) is printed,
+    returned and optionally written to summary_out as JSON.
+
+    Latency is amortized: each question is charged its share of its batch's
+    retrieval (and, for rerank, reranking) time.
+    """
+    questions = load_questions(questions_path)
+    if not questions:
+        raise ValueError(f"No questions in {questions_path}")
+    batches = [questions[i:i + batch_size] for i in range(0, len(questions), batch_size)]
+
+    t0 = time.perf_counter()
+    # Threads share the loaded models; FAISS, torch and sqlite release the GIL
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        results = [r for batch in pool.map(lambda b: _evaluate_batch(b, k, nprobe, ef_search), batches) for r in batch]
+    wall_s = time.perf_counter() - t0
+
+    fieldnames = ["question"] + [
+        f"{mode}_{name}" for mode in MODES
+        for name in ("top", "abstain", "ms", "recall", "rr", "ndcg", "neg_rate")
+    ]
+    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        for r in results:
+            writer.writerow({key: f"{v:.3f}" if isinstance(v, float) else v for key, v in r.items()})
+    print(f"Wrote results to {out_csv}")
+
+    summary = summarize(results, k, wall_s)
+    for mode, stats in summary.items():
+        print(f"{mode:9s} " + "  ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                                        for key, value in stats.items()))
+    if summary_out:
+        with open(summary_out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote summary to {summary_out}")
+    return summary
+
+
+def depth_curve(questions_path: str, out_csv: str, depths: List[int], k: int = 5):
+    """
+    Latency/quality trade-off of the rerank cascade: for every candidate depth,
+    mean/p95 rerank latency, agreement of the top-k with the deepest setting,
+    abstain rate and (when labeled) the share of questions with a positive in the top-k.
+    """
+    questions = load_questions(questions_path)
+
+    deepest = max(depths)
+    per_depth = {d: {"ms": [], "top": [], "ids": [], "hit": []} for d in depths}
+    # Same candidates for every depth so only the cascade differs
+    candidates_list = []
+    for i in range(0, len(questions), EVAL_BATCH_SIZE):
+        batch = [item["q"] for item in questions[i:i + EVAL_BATCH_SIZE]]
+        candidates_list += fetch_candidates_batch(batch, top_k=max(deepest, CANDIDATE_DEPTH))
+    for item, candidates in zip(questions, candidates_list):
+        q = item["q"]
+        positives = set(item.get("positives", []))
+        for d in depths:
+            t0 = time.perf_counter()
+            ranked = rerank_candidates(q, candidates, depth=max(d, k))[:k]
+            per_depth[d]["ms"].append((time.perf_counter() - t0) * 1000)
+            per_depth[d]["top"].append(ranked[0].get("rerank_score", 0.0) if ranked else 0.0)
+            per_depth[d]["ids"].append([r["chunk_id"] for r in ranked])
+            if positives:
+                per_depth[d]["hit"].append(any(r["chunk_id"] in positives for r in ranked))
+
+    rows = []
+    reference = per_depth[deepest]["ids"]
+    for d in depths:
+        stats = per_depth[d]
+        overlap = [len(set(a) & set(b)) / float(max(len(b), 1)) for a, b in zip(stats["ids"], reference)]
+        rows.append({
+            "depth": d,
+            "mean_ms": f"{np.mean(stats['ms']):.1f}",
+            "p95_ms": f"{np.percentile(stats['ms'], 95):.1f}",
+            f"overlap@{k}_vs_depth_{deepest}": f"{np.mean(overlap):.3f}",
+            "abstain_rate": f"{np.mean([t < 0.45 for t in stats['top']]):.3f}",
+            f"positive_in_top{k}": f"{np.mean(stats['hit']):.3f}" if stats["hit"] else "",
+        })
 
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
         writer.writeheader()
         for r in rows:
             writer.writerow(r)
-    print(f"Wrote results to {out_csv}")
+            print("  ".join(f"{key}={value}" for key, value in r.items()))
+    print(f"Wrote depth curve to {out_csv}")
 
 
 if __name__ == "__main__":
@@ -59,8 +214,20 @@ if __name__ == "__main__":
     parser.add_argument("questions", help="questions.jsonl path")
     parser.add_argument("--out", default="data/eval_results.csv")
     parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=EVAL_BATCH_SIZE, help="Questions per retrieval call")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Batches evaluated concurrently")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--summary-out", default=None, help="Write the per-mode summary as JSON (diff across configs)")
+    parser.add_argument("--depths", default=None,
+                        help="Comma-separated rerank depths, e.g. 5,10,20,50: report the latency/quality curve instead")
+    parser.add_argument("--curve-out", default="data/depth_curve.csv")
     args = parser.parse_args()
 
-    evaluate(args.questions, args.out, k=args.k)
+    if args.depths:
+        depth_curve(args.questions, args.curve_out, [int(d) for d in args.depths.split(",")], k=args.k)
+    else:
+        evaluate(args.questions, args.out, k=args.k, batch_size=args.batch_size, workers=args.workers,
+                 nprobe=args.nprobe, ef_search=args.ef_search, summary_out=args.summary_out)
 
 
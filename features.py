@@ -1,13 +1,16 @@
-import sqlite3
 import json
-import re
-from typing import List, Tuple, Dict
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Optional
 
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 
-DB_PATH = "data/chunks.db"
+import chunk_store
+import index_spec
+from embedding_cache import encode_cached
+from inference import LazyModel, embedding_key, load_bi_encoder
+
 INDEX_PATH = "data/faiss_index.bin"
 MAPPING_PATH = "data/id_mapping.npy"
 
@@ -16,61 +19,43 @@ class CandidateRetriever:
     def __init__(self):
         self.index = faiss.read_index(INDEX_PATH)
         self.id_mapping = np.load(MAPPING_PATH)
-        self.encoder = SentenceTransformer("all-mpnet-base-v2")
+        self.spec = index_spec.load_spec()
+        self.encoder = load_bi_encoder()
+
+    def encode(self, queries: List[str], batch_size: int = 64) -> np.ndarray:
+        return np.asarray(self.encoder.encode(queries, normalize_embeddings=True, batch_size=batch_size),
+                          dtype="float32")
+
+    def fetch(self, query: str, top_k: int = 20, nprobe: Optional[int] = None,
+              ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self.fetch_batch([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search)[0]
+
+    def fetch_batch(self, queries: List[str], top_k: int = 20, nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None, q_emb: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        # One encode call and one multi-row FAISS search for all queries
+        if q_emb is None:
+            q_emb = self.encode(queries)
+        distances, faiss_indices = index_spec.search(self.index, self.spec, q_emb, top_k,
+                                                     nprobe=nprobe, ef_search=ef_search)
+        return [index_spec.hits(self.spec, self.id_mapping, distances[row], faiss_indices[row])
+                for row in range(len(queries))]
 
-    def fetch(self, query: str, top_k: int = 20) -> List[Tuple[int, float]]:
-        query_emb = self.encoder.encode([query], normalize_embeddings=True)
-        distances, faiss_indices = self.index.search(query_emb, top_k)
-        chunk_ids = self.id_mapping[faiss_indices[0]]
-        return [(int(cid), float(score)) for cid, score in zip(chunk_ids, distances[0])]
+
+# Loaded on first use and shared by every call in this process
+retriever = LazyModel(CandidateRetriever)
 
 
 def fetch_chunk_texts(chunk_ids: List[int]) -> Dict[int, str]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    placeholders = ",".join(["?"] * len(chunk_ids))
-    cur.execute(f"SELECT chunk_id, chunk_text FROM chunks WHERE chunk_id IN ({placeholders})", tuple(chunk_ids))
-    rows = cur.fetchall()
-    conn.close()
-    return {int(cid): text for cid, text in rows}
-
-
-def _to_fts_query(raw: str) -> str:
-    # Keep only alphanumeric tokens; join with OR to avoid FTS syntax errors
-    tokens = re.findall(r"[A-Za-z0-9]+", raw.lower())
-    # If empty after cleaning, return a token that won't match anything
-    if not tokens:
-        return "__nomatch__"
-    return " OR ".join(tokens)
-
-
-def bm25_scores(query: str, chunk_ids: List[int]) -> Dict[int, float]:
-    if not chunk_ids:
-        return {}
-    fts_query = _to_fts_query(query)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    # Use FTS5 BM25 ranking via rank function. We restrict by rowid IN (...)
-    placeholders = ",".join(["?"] * len(chunk_ids))
-    cur.execute(
-        f"""
-        SELECT rowid, bm25(chunks_fts) as score
-        FROM chunks_fts
-        WHERE chunks_fts MATCH ?
-        AND rowid IN ({placeholders})
-        ORDER BY score
-        """,
-        tuple([fts_query] + [int(cid) for cid in chunk_ids]),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    # FTS bm25: lower is better (since it's a distance). Convert to descending score with negative.
-    return {int(rowid): -float(score) for rowid, score in rows}
+    return {cid: row["text"] for cid, row in chunk_store.fetch_chunks(chunk_ids).items()}
+
+
+# Kept here for existing importers (eval.py); the implementation lives in chunk_store
+_to_fts_query = chunk_store.to_fts_query
+bm25_scores = chunk_store.bm25_scores
 
 
 def compute_features(query: str, top_k: int = 20) -> List[Dict]:
-    retriever = CandidateRetriever()
-    candidates = retriever.fetch(query, top_k=top_k)
+    candidates = retriever.get().fetch(query, top_k=top_k)
     candidate_ids = [cid for cid, _ in candidates]
 
     id_to_text = fetch_chunk_texts(candidate_ids)
@@ -92,58 +77,122 @@ def compute_features(query: str, top_k: int = 20) -> List[Dict]:
     return features
 
 
-def save_features_for_questions(questions_path: str, out_path: str, top_k: int = 20):
+def feature_rows_for_batch(items: List[Dict], top_k: int = 20, nprobe: Optional[int] = None,
+                           ef_search: Optional[int] = None) -> List[Dict]:
     """
-    questions.jsonl lines like: {"q": "...", "positives": [chunk_id,...], "negatives": [chunk_id,...]}
+    Training rows for a batch of labeled questions: one encode for all
+    questions, one multi-row FAISS search, BM25 per question over its
+    candidates, and one cached encode of the labeled chunks that were not
+    retrieved (their vector score is the dot product with the question).
     """
+    r = retriever.get()
+    queries = [item["q"] for item in items]
+    q_emb = r.encode(queries)
+    hits = r.fetch_batch(queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search, q_emb=q_emb)
+
+    # Labeled chunk_ids missing from each question's top-k, in the iteration order of
+    # (pos | neg) - present like the per-question version, so rows come out in the same order
+    required = []
+    for item, cands in zip(items, hits):
+        present = {cid for cid, _ in cands}
+        labeled = set(item.get("positives", [])) | set(item.get("negatives", []))
+        required.append([int(cid) for cid in labeled - present])
+    extra_texts = fetch_chunk_texts([cid for ids in required for cid in ids])
+    extra_ids = sorted(cid for cid, text in extra_texts.items() if text)
+    # Chunk vectors come from the shared embedding cache; only unseen text is encoded
+    extra_vecs = dict(zip(extra_ids, encode_cached(r.encoder, embedding_key(),
+                                                   [extra_texts[cid] for cid in extra_ids])))
+
     rows = []
+    for item, row_emb, cands, missing in zip(items, q_emb, hits, required):
+        q = item["q"]
+        pos = set(item.get("positives", []))
+        neg = set(item.get("negatives", []))
+        missing = [cid for cid in missing if cid in extra_vecs]
+        id_to_bm25 = bm25_scores(q, [cid for cid, _ in cands] + missing)
+
+        feats = sorted(
+            ({"chunk_id": cid, "vector_score": float(score), "bm25_score": float(id_to_bm25.get(cid, 0.0))}
+             for cid, score in cands),
+            key=lambda f: (0.7 * f["vector_score"]) + (0.3 * f["bm25_score"]),
+            reverse=True,
+        )
+        feats += [
+            {"chunk_id": cid, "vector_score": float(np.dot(row_emb, extra_vecs[cid])),
+             "bm25_score": float(id_to_bm25.get(cid, 0.0))}
+            for cid in missing
+        ]
+        for f in feats:
+            if f["chunk_id"] in pos:
+                label = 1
+            elif f["chunk_id"] in neg:
+                label = 0
+            else:
+                label = None
+            rows.append(dict(q=q, **f, label=label))
+    return rows
+
+
+def _iter_question_batches(questions_path: str, batch_size: int):
+    batch = []
     with open(questions_path, "r", encoding="utf-8") as f:
         for line in f:
             if not line.strip():
                 continue
-            item = json.loads(line)
-            q = item["q"]
-            pos = set(item.get("positives", []))
-            neg = set(item.get("negatives", []))
-
-            feats = compute_features(q, top_k=top_k)
-            # Ensure that labeled chunk_ids are present even if not in top-k
-            present_ids = {r["chunk_id"] for r in feats}
-            required_ids = (pos | neg) - present_ids
-            if required_ids:
-                extra_texts = fetch_chunk_texts(list(required_ids))
-                extra_bm25 = bm25_scores(q, list(required_ids))
-                encoder = CandidateRetriever().encoder
-                q_vec = encoder.encode([q], normalize_embeddings=True)[0]
-                for cid in required_ids:
-                    text = extra_texts.get(int(cid), "")
-                    if not text:
-                        continue
-                    t_vec = encoder.encode([text], normalize_embeddings=True)[0]
-                    vec_score = float(np.dot(q_vec, t_vec))
-                    feats.append({
-                        "chunk_id": int(cid),
-                        "vector_score": vec_score,
-                        "bm25_score": float(extra_bm25.get(int(cid), 0.0)),
-                        "text": text,
-                    })
-            for r in feats:
-                if r["chunk_id"] in pos:
-                    label = 1
-                elif r["chunk_id"] in neg:
-                    label = 0
-                else:
-                    label = None
-                rows.append({
-                    "q": q,
-                    "chunk_id": r["chunk_id"],
-                    "vector_score": r["vector_score"],
-                    "bm25_score": r["bm25_score"],
-                    "label": label,
-                })
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _feature_rows_worker(args):
+    items, top_k = args
+    return len(items), feature_rows_for_batch(items, top_k=top_k)
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r) + "\n")
 
+def save_features_for_questions(questions_path: str, out_path: str, top_k: int = 20,
+                                batch_size: int = 64, workers: int = 1):
+    """
+    questions.jsonl lines like: {"q": "...", "positives": [chunk_id,...], "negatives": [chunk_id,...]}
 
+    Questions are processed `batch_size` at a time and rows are streamed to
+    out_path in input order. With workers > 1, batches are spread over a
+    process pool; each worker loads its own copy of the index and model.
+    """
+    batches = ((items, top_k) for items in _iter_question_batches(questions_path, batch_size))
+    n_questions = n_rows = 0
+    t0 = time.perf_counter()
+    with open(out_path, "w", encoding="utf-8") as f:
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(_feature_rows_worker, batches)
+        else:
+            pool = None
+            results = map(_feature_rows_worker, batches)
+        try:
+            for n_items, rows in results:
+                for r in rows:
+                    f.write(json.dumps(r) + "\n")
+                n_rows += len(rows)
+                n_questions += n_items
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    elapsed = time.perf_counter() - t0
+    print(f"Wrote {n_rows} feature rows for {n_questions} questions to {out_path} "
+          f"in {elapsed:.1f}s ({n_questions / max(elapsed, 1e-9):.1f} questions/s)")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions", help="Labeled questions jsonl")
+    parser.add_argument("out", help="Feature rows jsonl for train_reranker.py")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions encoded and searched together")
+    parser.add_argument("--workers", type=int, default=1, help="Processes; each loads its own index and model")
+    args = parser.parse_args()
+    save_features_for_questions(args.questions, args.out, top_k=args.top_k,
+                                batch_size=args.batch_size, workers=args.workers)
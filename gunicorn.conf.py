@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+"""
+Prefork serving of asgi_app:
+
+  gunicorn asgi_app:app -c gunicorn.conf.py
+
+The app is imported and the bi-encoder, cross-encoder or LR scorer, and the
+FAISS index are loaded once in the master before forking, so workers share
+those pages copy-on-write. The index is memory-mapped (FAISS_MMAP=1), so it
+stays shared after hot swaps too. Each worker gets cpu_count / workers torch
+and FAISS threads unless TORCH_NUM_THREADS is set.
+
+WEB_CONCURRENCY   worker processes (default 2)
+PORT              listen port (default 8000)
+"""
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+
+# Read by index_spec / inference at import, which preload_app does right after this file
+os.environ.setdefault("FAISS_MMAP", "1")
+os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+
+def when_ready(server):
+    # Models load lazily, so load them (and map the index) in the master now. Only
+    # load here: running inference would start OpenMP thread pools, which don't survive fork.
+    import api
+    api.load_models()
+    try:
+        api.engine.snapshot()
+    except (OSError, RuntimeError) as e:
+        server.log.warning("index not loaded before fork: %s", e)
+
+
+def post_fork(server, worker):
+    import inference
+    inference.set_num_threads()
@@ -0,0 +1,152 @@
+# index_spec.py
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+SPEC_PATH = "data/index_spec.json"
+DEFAULT_FACTORY = "Flat"
+# Serve the index from a read-only mmap of faiss_index.bin, so worker processes share its pages
+FAISS_MMAP = os.environ.get("FAISS_MMAP", "0") == "1"
+
+# Factory strings understood by faiss.index_factory, e.g.
+#   "Flat"             exact brute force (default)
+#   "IVF1024,Flat"     inverted file with 1024 lists, tune with nprobe
+#   "HNSW32"           HNSW graph with M=32, tune with efSearch / efConstruction
+#   "IVF1024,PQ16"     inverted file + product quantization (16 bytes per vector)
+
+
+def new_index(factory: str, dim: int, train_sample: Optional[np.ndarray] = None,
+              ef_construction: Optional[int] = None, with_ids: bool = True):
+    """
+    Empty inner-product index from a factory string, trained on
+    `train_sample` if the type needs training. With `with_ids`, the index is
+    wrapped in IndexIDMap2 so searches return chunk_ids and rows can later be
+    changed with add_with_ids / remove_ids.
+    """
+    index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+    hnsw = _hnsw_of(index)
+    if hnsw is not None and ef_construction:
+        hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        if train_sample is None or not len(train_sample):
+            raise ValueError(f"{factory} needs training vectors")
+        print(f"Training {factory} on {len(train_sample)} vectors...")
+        index.train(train_sample)
+    return faiss.IndexIDMap2(index) if with_ids else index
+
+
+def build_faiss_index(
+    factory: str,
+    embeddings: np.ndarray,
+    ids: Optional[np.ndarray] = None,
+    train_size: int = 50000,
+    ef_construction: Optional[int] = None,
+    seed: int = 42,
+):
+    """Create an index with new_index(), training on a random sample of `embeddings`, and add all vectors."""
+    rng = np.random.default_rng(seed)
+    n_train = min(len(embeddings), train_size)
+    sample = embeddings[rng.choice(len(embeddings), n_train, replace=False)]
+    index = new_index(factory, embeddings.shape[1], train_sample=sample, ef_construction=ef_construction,
+                      with_ids=ids is not None)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def supports_remove(factory: str) -> bool:
+    # HNSW graphs cannot drop vectors; every other supported type can
+    return "HNSW" not in factory.upper()
+
+
+def save_spec(path: str, factory: str, index, nprobe: Optional[int] = None,
+              ef_search: Optional[int] = None, ef_construction: Optional[int] = None,
+              labels: str = "chunk_id"):
+    spec = {
+        "factory": factory,
+        # "chunk_id": search labels are chunk_ids; "position": labels index into id_mapping.npy
+        "labels": labels,
+        "metric": "inner_product",
+        "dim": int(index.d),
+        "ntotal": int(index.ntotal),
+        "nprobe": nprobe,
+        "ef_search": ef_search,
+        "ef_construction": ef_construction,
+        "built_at": int(time.time()),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def load_spec(path: str = SPEC_PATH) -> Dict:
+    # Indexes built before specs existed are always exact Flat indexes
+    if not os.path.exists(path):
+        return {"factory": DEFAULT_FACTORY}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_index(path: str, spec: Optional[Dict] = None, mmap: Optional[bool] = None):
+    """
+    Load a saved index. With mmap, IVF inverted lists (IO_FLAG_MMAP) or flat
+    codes (IO_FLAG_MMAP_IFC) are mapped read-only instead of copied to the
+    heap; index types that can't be mapped are read normally.
+    """
+    if not (FAISS_MMAP if mmap is None else mmap):
+        return faiss.read_index(path)
+    factory = (spec or {}).get("factory", DEFAULT_FACTORY)
+    flag = faiss.IO_FLAG_MMAP
+    if not factory.startswith("IVF") and hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flag = faiss.IO_FLAG_MMAP_IFC
+    try:
+        return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def search_params(spec: Dict, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Per-request search parameters for the index described by `spec`.
+    Request values override the defaults stored in the spec; returns None
+    for exact indexes (or when nothing is set) so search() uses its defaults.
+    """
+    factory = spec.get("factory", DEFAULT_FACTORY).upper()
+    nprobe = nprobe or spec.get("nprobe")
+    ef_search = ef_search or spec.get("ef_search")
+    if factory.startswith("IVF") and nprobe:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if factory.startswith("HNSW") and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def search(index, spec: Dict, q_emb: np.ndarray, top_k: int,
+           nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    params = search_params(spec, nprobe=nprobe, ef_search=ef_search)
+    if params is None:
+        return index.search(q_emb, top_k)
+    return index.search(q_emb, top_k, params=params)
+
+
+def hits(spec: Dict, id_mapping: np.ndarray, scores: np.ndarray, labels: np.ndarray) -> List[Tuple[int, float]]:
+    """(chunk_id, score) pairs for one result row, skipping the -1 padding of approximate indexes."""
+    by_chunk_id = spec.get("labels") == "chunk_id"
+    return [
+        (int(label) if by_chunk_id else int(id_mapping[label]), float(score))
+        for score, label in zip(scores, labels)
+        if label >= 0
+    ]
+
+
+def _hnsw_of(index):
+    try:
+        return faiss.downcast_index(index).hnsw
+    except AttributeError:
+        return None
@@ -0,0 +1,217 @@
+# inference.py
+"""
+One place to choose how the bi-encoder and cross-encoder run on CPU.
+
+INFERENCE_BACKEND:
+  torch   full-precision PyTorch (default)
+  int8    PyTorch with dynamic int8 quantization of every nn.Linear
+  onnx    ONNX Runtime export (needs `pip install optimum[onnxruntime]`);
+          set ONNX_FILE_NAME to load a quantized export, e.g. onnx/model_qint8_avx512_vnni.onnx
+  hash    tiny offline stand-ins (feature hashing / term overlap); no download,
+          no torch, for benchmarks and smoke tests only
+
+TORCH_NUM_THREADS caps intra-op threads for torch and FAISS (default: library
+default, i.e. all cores); set it per worker when running several processes.
+
+Nothing heavy is imported until a model is loaded; wrap loaders in LazyModel
+to defer that to first use.
+
+Check a backend against PyTorch on the corpus before switching:
+  python inference.py --backend int8 --sample 200
+"""
+import os
+import re
+import threading
+import zlib
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer, CrossEncoder
+
+BI_ENCODER_NAME = "all-mpnet-base-v2"
+CROSS_ENCODER_NAME = "cross-encoder/ms-marco-electra-base"
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+ONNX_FILE_NAME = os.environ.get("ONNX_FILE_NAME")
+BACKENDS = ("torch", "int8", "onnx", "hash")
+HASH_DIM = 256
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", 0))
+
+
+def _check(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown INFERENCE_BACKEND {backend!r}; expected one of {BACKENDS}")
+    return backend
+
+
+def _onnx_kwargs() -> dict:
+    kwargs = {"backend": "onnx"}
+    if ONNX_FILE_NAME:
+        kwargs["model_kwargs"] = {"file_name": ONNX_FILE_NAME}
+    return kwargs
+
+
+def set_num_threads(n: int = TORCH_NUM_THREADS):
+    """Intra-op threads for torch and FAISS in this process; 0 leaves the defaults."""
+    if n <= 0:
+        return
+    import faiss
+    import torch
+    torch.set_num_threads(n)
+    faiss.omp_set_num_threads(n)
+
+
+def _quantize_int8(module):
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def embedding_key(backend: Optional[str] = None) -> str:
+    """Model name for the embedding cache; quantized backends produce different vectors."""
+    backend = _check(backend or INFERENCE_BACKEND)
+    if backend == "torch":
+        return BI_ENCODER_NAME
+    if backend == "hash":
+        return f"hash-{HASH_DIM}"
+    return f"{BI_ENCODER_NAME}@{backend}{':' + ONNX_FILE_NAME if backend == 'onnx' and ONNX_FILE_NAME else ''}"
+
+
+class LazyModel:
+    """Calls `loader` on first get(), once, even when several threads ask at the same time."""
+
+    def __init__(self, loader: Callable[[], Any]):
+        self.loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> Any:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self.loader()
+                    self._loaded = True
+        return self._value
+
+
+def _tokens(text: str):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class HashingEncoder:
+    """Bi-encoder stand-in: signed feature hashing of unigrams and bigrams into HASH_DIM dims."""
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        out = np.zeros((len(sentences), self.dim), dtype="float32")
+        for row, text in enumerate(sentences):
+            toks = _tokens(text)
+            for feat in toks + [a + " " + b for a, b in zip(toks, toks[1:])]:
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+class OverlapCrossEncoder:
+    """Cross-encoder stand-in: share of query terms that occur in the passage."""
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs) -> np.ndarray:
+        scores = []
+        for query, passage in pairs:
+            q = set(_tokens(query))
+            scores.append(len(q & set(_tokens(passage))) / len(q) if q else 0.0)
+        return np.array(scores, dtype="float32")
+
+
+def load_bi_encoder(backend: Optional[str] = None) -> "SentenceTransformer":
+    backend = _check(backend or INFERENCE_BACKEND)
+    if backend == "hash":
+        return HashingEncoder()
+    from sentence_transformers import SentenceTransformer
+    set_num_threads()
+    if backend == "onnx":
+        return SentenceTransformer(BI_ENCODER_NAME, **_onnx_kwargs())
+    model = SentenceTransformer(BI_ENCODER_NAME)
+    if backend == "int8":
+        model = _quantize_int8(model)
+    return model
+
+
+def load_cross_encoder(backend: Optional[str] = None, max_length: Optional[int] = None) -> "CrossEncoder":
+    backend = _check(backend or INFERENCE_BACKEND)
+    if backend == "hash":
+        return OverlapCrossEncoder()
+    from sentence_transformers import CrossEncoder
+    set_num_threads()
+    if backend == "onnx":
+        return CrossEncoder(CROSS_ENCODER_NAME, max_length=max_length, **_onnx_kwargs())
+    model = CrossEncoder(CROSS_ENCODER_NAME, max_length=max_length)
+    if backend == "int8":
+        model.model = _quantize_int8(model.model)
+    return model
+
+
+def _rank_agreement(a: np.ndarray, b: np.ndarray, k: int):
+    """(Spearman rho, top-1 match, overlap@k) between two score vectors for the same candidates."""
+    ra = np.argsort(np.argsort(-a))
+    rb = np.argsort(np.argsort(-b))
+    n = len(a)
+    rho = 1.0 - 6.0 * float(np.sum((ra - rb) ** 2)) / (n * (n * n - 1)) if n > 1 else 1.0
+    top_a, top_b = set(np.argsort(-a)[:k]), set(np.argsort(-b)[:k])
+    return rho, float(np.argmax(a) == np.argmax(b)), len(top_a & top_b) / float(min(k, n))
+
+
+def parity_report(backend: str, sample: int = 200, questions_path: str = "questions.jsonl",
+                  candidates: int = 20, k: int = 5, seed: int = 42):
+    """Cosine drift of chunk embeddings and rerank-order agreement of `backend` vs PyTorch."""
+    import json
+    import sqlite3
+
+    conn = sqlite3.connect("data/chunks.db")
+    texts = [r[0] for r in conn.execute("SELECT chunk_text FROM chunks ORDER BY random() LIMIT ?", (sample,))]
+    conn.close()
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = [json.loads(line)["q"] for line in f if line.strip()]
+    print(f"Parity of {backend} vs torch on {len(texts)} chunks and {len(questions)} questions")
+
+    ref_bi, cand_bi = load_bi_encoder("torch"), load_bi_encoder(backend)
+    ref = ref_bi.encode(texts, normalize_embeddings=True, batch_size=32)
+    got = cand_bi.encode(texts, normalize_embeddings=True, batch_size=32)
+    cos = np.sum(ref * got, axis=1)
+    print(f"bi-encoder cosine(torch, {backend}): mean={cos.mean():.5f} min={cos.min():.5f} "
+          f"p1={np.percentile(cos, 1):.5f}")
+
+    # Rerank agreement on each question's nearest chunks from the sample
+    q_emb = ref_bi.encode(questions, normalize_embeddings=True)
+    ref_ce, cand_ce = load_cross_encoder("torch"), load_cross_encoder(backend)
+    stats = []
+    for q, qv in zip(questions, q_emb):
+        nearest = np.argsort(-(ref @ qv))[:candidates]
+        pairs = [(q, texts[i]) for i in nearest]
+        stats.append(_rank_agreement(np.asarray(ref_ce.predict(pairs)), np.asarray(cand_ce.predict(pairs)), k))
+    rho, top1, overlap = np.mean(stats, axis=0)
+    print(f"cross-encoder agreement: spearman={rho:.4f} top1={top1:.3f} overlap@{k}={overlap:.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="int8", choices=BACKENDS)
+    parser.add_argument("--sample", type=int, default=200, help="Random chunks to embed and rerank")
+    parser.add_argument("--questions", default="questions.jsonl")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    parity_report(args.backend, sample=args.sample, questions_path=args.questions, k=args.k)
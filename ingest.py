@@ -1,26 +1,43 @@
 import os
 import json
 import sqlite3
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 from pathlib import Path
-from utils import chunk_text, sha1_hash
+import sentences
+from utils import iter_chunks, sha1_hash, file_sha1
 
 DB_PATH = "data/chunks.db"
 PDF_DIR = "data/pdfs"
 SOURCES_FILE = "sources copy.json"
+# Large PDFs are split into page ranges of this size so one document can use several workers
+PAGES_PER_TASK = 16
+# Rows per executemany() call on the bulk write path
+BATCH_SIZE = 1000
 
-def init_db():
+def init_db(full=False):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute("DROP TABLE IF EXISTS chunks;")
-    cur.execute("DROP TABLE IF EXISTS docs;")
-    cur.execute("DROP TABLE IF EXISTS chunks_fts;")
+    # WAL lets the API keep reading while ingestion writes; NORMAL is durable enough under WAL
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA cache_size=-65536")  # 64 MiB
+    cur.execute("PRAGMA temp_store=MEMORY")
+    if full:
+        cur.execute("DROP TABLE IF EXISTS chunks;")
+        cur.execute("DROP TABLE IF EXISTS docs;")
+        cur.execute("DROP TABLE IF EXISTS chunks_fts;")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS docs (
             doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT,
             title TEXT,
-            url TEXT
+            url TEXT,
+            file_sha1 TEXT,
+            deleted_at TEXT
         )
     """)
     cur.execute("""
@@ -29,6 +46,11 @@ def init_db():
             doc_id INTEGER,
             chunk_text TEXT,
             chunk_sha1 TEXT,
+            page_start INTEGER,
+            page_end INTEGER,
+            char_start INTEGER,
+            char_end INTEGER,
+            sentence_index BLOB,
             FOREIGN KEY (doc_id) REFERENCES docs(doc_id)
         )
     """)
@@ -41,25 +63,192 @@ def init_db():
         );
         """
     )
+    # Databases created before incremental ingestion lack these columns
+    ensure_column(cur, "docs", "file_sha1", "TEXT")
+    ensure_column(cur, "docs", "deleted_at", "TEXT")
+    for column in ("page_start", "page_end", "char_start", "char_end"):
+        ensure_column(cur, "chunks", column, "INTEGER")
+    ensure_column(cur, "chunks", "sentence_index", "BLOB")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks(doc_id)")
     conn.commit()
     return conn
 
+def ensure_column(cur, table, column, decl):
+    cols = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
 def extract_text_from_pdf(path):
-    text = []
+    return "\n".join(t for t in iter_pdf_pages(path) if t)
+
+def iter_pdf_pages(path):
+    # Stream page texts so callers never hold more than the current page.
+    # Pages without text yield "" so chunk page numbers stay aligned with the PDF.
     with pdfplumber.open(path) as pdf:
         for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text.append(page_text)
-    return "\n".join(text)
+            yield page.extract_text() or ""
+            page.flush_cache()
 
-def main():
-    conn = init_db()
-    cur = conn.cursor()
+def extract_page_range(path, start, end):
+    # Runs in a worker process
+    texts = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text() or "")
+            page.flush_cache()
+    return texts
 
-    with open(SOURCES_FILE, "r") as f:
-        sources = json.load(f)
+def page_ranges(path, pages_per_task=PAGES_PER_TASK):
+    with pdfplumber.open(path) as pdf:
+        n_pages = len(pdf.pages)
+    return [(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task)]
+
+def iter_pages_parallel(pool, jobs, window):
+    """
+    Yield (job_index, page_texts) for every page range of every job, in
+    document/page order, while at most `window` ranges are in flight.
+    Results arrive in order, so one writer can stream them into SQLite.
+    """
+    tasks = ((i, job["pdf_path"], start, end)
+             for i, job in enumerate(jobs)
+             for start, end in page_ranges(job["pdf_path"]))
+    pending = deque()
+    for i, path, start, end in itertools.islice(tasks, window):
+        pending.append((i, pool.submit(extract_page_range, path, start, end)))
+    while pending:
+        i, fut = pending.popleft()
+        for j, path, start, end in itertools.islice(tasks, 1):
+            pending.append((j, pool.submit(extract_page_range, path, start, end)))
+        yield i, fut.result()
+
+class BulkChunkWriter:
+    """
+    Buffers chunk inserts and writes them with executemany() in batches of
+    BATCH_SIZE. With defer_fts=True the FTS mirror is not touched at all and
+    is rebuilt once by finish(); otherwise each batch is mirrored with a
+    single INSERT ... SELECT.
+    """
+
+    def __init__(self, conn, defer_fts=False):
+        self.cur = conn.cursor()
+        self.defer_fts = defer_fts
+        self.pending = []
+        self.added = 0
+        self.removed = 0
+
+    def insert(self, doc_id, text, h, location):
+        # Sentence boundaries and token ids for snippet selection (see sentences.py)
+        self.pending.append((doc_id, text, h) + location + (sentences.pack(sentences.build(text)),))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def update_locations(self, rows):
+        # rows: (page_start, page_end, char_start, char_end, chunk_id)
+        self.cur.executemany(
+            "UPDATE chunks SET page_start = ?, page_end = ?, char_start = ?, char_end = ? WHERE chunk_id = ?",
+            rows,
+        )
+
+    def delete(self, rows):
+        # rows: (chunk_id, chunk_text); external-content FTS needs the old text to delete
+        if not rows:
+            return
+        if not self.defer_fts:
+            self.cur.executemany(
+                "INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text) VALUES ('delete', ?, ?)", rows)
+        self.cur.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(cid,) for cid, _ in rows])
+        self.removed += len(rows)
+
+    def flush(self):
+        if not self.pending:
+            return
+        # AUTOINCREMENT ids only grow and we are the single writer, so the new rows are exactly those above this
+        self.cur.execute("SELECT COALESCE(MAX(chunk_id), 0) FROM chunks")
+        max_before = self.cur.fetchone()[0]
+        self.cur.executemany(
+            """INSERT INTO chunks (doc_id, chunk_text, chunk_sha1, page_start, page_end, char_start, char_end,
+                                  sentence_index)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            self.pending,
+        )
+        if not self.defer_fts:
+            # Insert into FTS mirror table
+            self.cur.execute(
+                "INSERT INTO chunks_fts(rowid, chunk_text) SELECT chunk_id, chunk_text FROM chunks WHERE chunk_id > ?",
+                (max_before,),
+            )
+        self.added += len(self.pending)
+        self.pending = []
+
+    def finish(self):
+        self.flush()
+        if self.defer_fts:
+            print("🔎 Rebuilding full-text index ...")
+            self.cur.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+
+def sync_doc_chunks(writer, doc_id, chunks):
+    """Insert chunks whose sha1 is new for this doc and delete the ones that disappeared.
+    Unchanged chunks keep their chunk_id, so build_index.py does not re-embed them."""
+    existing = {}
+    writer.cur.execute("SELECT chunk_id, chunk_sha1, chunk_text FROM chunks WHERE doc_id = ?", (doc_id,))
+    for chunk_id, h, text in writer.cur.fetchall():
+        existing.setdefault(h, []).append((chunk_id, text))
+
+    added = 0
+    moved = []
+    for ch in chunks:
+        h = sha1_hash(ch.text)
+        location = (ch.page_start, ch.page_end, ch.char_start, ch.char_end)
+        if existing.get(h):
+            chunk_id, _ = existing[h].pop()
+            # Same text, but surrounding edits may have moved it
+            moved.append(location + (chunk_id,))
+            continue
+        writer.insert(doc_id, ch.text, h, location)
+        added += 1
+
+    writer.update_locations(moved)
+    stale = [row for rows in existing.values() for row in rows]
+    writer.delete(stale)
+    return added, len(stale)
 
+def backfill_sentence_index(cur):
+    """Index the sentences of chunks ingested before chunks.sentence_index existed."""
+    filled, last_id = 0, 0
+    while True:
+        cur.execute(
+            "SELECT chunk_id, chunk_text FROM chunks WHERE sentence_index IS NULL AND chunk_id > ? "
+            "ORDER BY chunk_id LIMIT ?",
+            (last_id, BATCH_SIZE),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        cur.executemany(
+            "UPDATE chunks SET sentence_index = ? WHERE chunk_id = ?",
+            [(sentences.pack(sentences.build(text or "")), cid) for cid, text in rows],
+        )
+        filled += len(rows)
+        last_id = rows[-1][0]
+    if filled:
+        print(f"🧩 Indexed sentences of {filled} existing chunks")
+    return filled
+
+def tombstone_missing_sources(writer, listed_filenames):
+    cur = writer.cur
+    cur.execute("SELECT doc_id, filename FROM docs WHERE deleted_at IS NULL")
+    for doc_id, filename in cur.fetchall():
+        if filename in listed_filenames:
+            continue
+        cur.execute("SELECT chunk_id, chunk_text FROM chunks WHERE doc_id = ?", (doc_id,))
+        writer.delete(cur.fetchall())
+        cur.execute("UPDATE docs SET deleted_at = datetime('now') WHERE doc_id = ?", (doc_id,))
+        print(f"🪦 Tombstoned {filename} (no longer in {SOURCES_FILE})")
+
+def plan_jobs(conn, sources):
+    """Hash every listed PDF and return the ones that are new or changed."""
+    cur = conn.cursor()
+    jobs = []
     for src in sources:
         filename, title, url = src["filename"], src["title"], src["url"]
         pdf_path = os.path.join(PDF_DIR, filename)
@@ -68,30 +257,93 @@ def main():
             print(f"⚠️ Missing {pdf_path}, skipping")
             continue
 
-        print(f"📄 Processing {filename} ...")
-        full_text = extract_text_from_pdf(pdf_path)
-
-        if not full_text.strip():
-            print(f"⚠️ No text extracted from {filename}, skipping")
+        file_hash = file_sha1(pdf_path)
+        cur.execute("SELECT doc_id, file_sha1 FROM docs WHERE filename = ? AND deleted_at IS NULL", (filename,))
+        row = cur.fetchone()
+        if row and row[1] == file_hash:
+            cur.execute("UPDATE docs SET title = ?, url = ? WHERE doc_id = ?", (title, url, row[0]))
+            print(f"✓ Unchanged {filename}, skipping")
             continue
 
-        # Insert doc row
-        cur.execute("INSERT INTO docs (filename, title, url) VALUES (?, ?, ?)",
-                    (filename, title, url))
+        jobs.append({
+            "filename": filename,
+            "title": title,
+            "url": url,
+            "pdf_path": pdf_path,
+            "file_hash": file_hash,
+            "doc_id": row[0] if row else None,
+        })
+    conn.commit()
+    return jobs
+
+def write_doc(writer, job, pages):
+    """Stream one document's page texts through the chunker and sync its rows.
+    Only the main process writes to SQLite."""
+    cur = writer.cur
+    filename = job["filename"]
+    chunks = iter_chunks(pages, max_chars=1200, overlap=200)
+    first = next(chunks, None)
+
+    if first is None:
+        print(f"⚠️ No text extracted from {filename}, skipping")
+        return 0, 0
+
+    # Insert or update doc row
+    doc_id = job["doc_id"]
+    if doc_id is not None:
+        cur.execute("UPDATE docs SET title = ?, url = ?, file_sha1 = ? WHERE doc_id = ?",
+                    (job["title"], job["url"], job["file_hash"], doc_id))
+    else:
+        cur.execute("INSERT INTO docs (filename, title, url, file_sha1) VALUES (?, ?, ?, ?)",
+                    (filename, job["title"], job["url"], job["file_hash"]))
         doc_id = cur.lastrowid
 
-        # Chunk text
-        chunks = chunk_text(full_text, max_chars=1200, overlap=200)
-        for ch in chunks:
-            cur.execute("INSERT INTO chunks (doc_id, chunk_text, chunk_sha1) VALUES (?, ?, ?)",
-                        (doc_id, ch, sha1_hash(ch)))
-            rowid = cur.lastrowid
-            # Insert into FTS mirror table
-            cur.execute("INSERT INTO chunks_fts(rowid, chunk_text) VALUES (?, ?)", (rowid, ch))
+    added, removed = sync_doc_chunks(writer, doc_id, itertools.chain([first], chunks))
+    print(f"   {filename}: +{added} / -{removed} chunks")
+    return added, removed
+
+def main(full=False, workers=1):
+    conn = init_db(full=full)
+    cur = conn.cursor()
+
+    with open(SOURCES_FILE, "r") as f:
+        sources = json.load(f)
+
+    jobs = plan_jobs(conn, sources)
+
+    # Loading into an empty table: skip per-row FTS maintenance and rebuild once at the end
+    cur.execute("SELECT 1 FROM chunks LIMIT 1")
+    writer = BulkChunkWriter(conn, defer_fts=cur.fetchone() is None)
 
-        conn.commit()
+    # Everything below is one transaction: a crash leaves the DB as it was, and a rerun redoes the work
+    t0 = time.perf_counter()
+    if workers > 1:
+        print(f"📄 Processing {len(jobs)} PDFs with {workers} workers ...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = iter_pages_parallel(pool, jobs, window=workers * 2)
+            for i, group in itertools.groupby(results, key=lambda r: r[0]):
+                pages = (text for _, texts in group for text in texts)
+                write_doc(writer, jobs[i], pages)
+    else:
+        for job in jobs:
+            print(f"📄 Processing {job['filename']} ...")
+            write_doc(writer, job, iter_pdf_pages(job["pdf_path"]))
+
+    tombstone_missing_sources(writer, {src["filename"] for src in sources})
+    writer.finish()
+    backfill_sentence_index(cur)
+    conn.commit()
+    elapsed = time.perf_counter() - t0
     conn.close()
-    print("✅ Ingestion complete!")
+    rate = writer.added / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Ingestion complete! (+{writer.added} / -{writer.removed} chunks "
+          f"in {elapsed:.1f}s, {rate:.0f} chunks/s)")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Drop all tables and re-ingest every PDF")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Extract PDFs (or page ranges of large PDFs) in this many processes")
+    args = parser.parse_args()
+    main(full=args.full, workers=args.workers)
@@ -0,0 +1,41 @@
+# linear_scorer.py
+import numpy as np
+
+# Plain coefficient export of data/reranker_lr.joblib, evaluated with NumPy at serving time
+COEF_PATH = "data/reranker_lr.npz"
+
+
+class LogisticScorer:
+    """
+    NumPy re-implementation of a binary sklearn LogisticRegression's
+    predict_proba(X)[:, 1], computed in float64. Scores equal sklearn's batched
+    predict_proba within float tolerance, not bit for bit: vectorized exp can
+    differ from scipy's expit in the last bit (~3e-16), and sklearn evaluates a
+    model fit on float32 features (as train_reranker.py does) in float32 (~1e-7).
+    """
+
+    def __init__(self, coef: np.ndarray, intercept: float):
+        self.coef = np.asarray(coef, dtype=np.float64).ravel()
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_sklearn(cls, clf) -> "LogisticScorer":
+        classes = list(clf.classes_)
+        if len(classes) != 2 or classes[1] != 1:
+            raise ValueError(f"expected a binary classifier with classes [0, 1], got {classes}")
+        return cls(clf.coef_[0], clf.intercept_[0])
+
+    @classmethod
+    def load(cls, path: str = COEF_PATH) -> "LogisticScorer":
+        data = np.load(path)
+        return cls(data["coef"], data["intercept"][0])
+
+    def save(self, path: str = COEF_PATH):
+        with open(path, "wb") as f:
+            np.savez(f, coef=self.coef, intercept=np.array([self.intercept]))
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probability of the positive class for every row of X; the linear part is one matrix operation."""
+        z = np.asarray(X) @ self.coef + self.intercept
+        with np.errstate(over="ignore"):  # exp(-z) is inf for very negative z, so the probability is 0
+            return 1.0 / (1.0 + np.exp(-z))
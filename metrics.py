@@ -0,0 +1,151 @@
+# metrics.py
+"""
+In-process counters, latency histograms and per-stage timing spans, rendered
+in the Prometheus text format for /metrics.
+
+    with metrics.collect() as timings:     # optional per-request breakdown
+        with metrics.span("encode"):       # ask_stage_seconds{stage="encode"}
+            ...
+    timings -> {"encode": 12.3}             # milliseconds
+
+Spans always feed the stage histogram; they also add to the innermost
+collect() of the current thread, if any. Values are per process.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Seconds; covers a cache hit (~0.1 ms) up to a slow cross-encoder pass
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + list(extra or ())
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            rows = sorted((key, list(row)) for key, row in self._values.items())
+        for key, row in rows:
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {row[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {row[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {row[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("ask_request_seconds", "End-to-end latency per question, by endpoint and mode")
+STAGE_SECONDS = Histogram("ask_stage_seconds", "Time spent in each pipeline stage (per batch)")
+REQUESTS = Counter("ask_requests_total", "Questions answered, by mode")
+ABSTAINS = Counter("ask_abstains_total", "Questions answered with an abstain, by mode")
+CACHE_HITS = Counter("ask_cache_hits_total", "Questions served from the query cache, by mode and level")
+
+_local = threading.local()
+
+
+@contextmanager
+def collect():
+    """Gather the spans run by this thread into a {stage: ms} dict."""
+    timings: Dict[str, float] = {}
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(timings)
+    try:
+        yield timings
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        stack = getattr(_local, "stack", None)
+        if stack:
+            stack[-1][stage] = round(stack[-1].get(stage, 0.0) + elapsed * 1000, 3)
+
+
+def add_timings(timings: Dict[str, float]):
+    """Add spans collected on another thread (e.g. a worker pool) to this thread's innermost collect()."""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        for stage, ms in timings.items():
+            stack[-1][stage] = round(stack[-1].get(stage, 0.0) + ms, 3)
+
+
+def merge_timings(*timings: Dict[str, float]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for t in timings:
+        for stage, ms in t.items():
+            out[stage] = round(out.get(stage, 0.0) + ms, 3)
+    return out
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
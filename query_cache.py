@@ -0,0 +1,164 @@
+# query_cache.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+# QUERY_CACHE_SIZE=0 disables the cache; QUERY_CACHE_SIMILARITY=0 keeps only the exact level
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL_S = float(os.environ.get("QUERY_CACHE_TTL_S", 3600))
+QUERY_CACHE_SIMILARITY = float(os.environ.get("QUERY_CACHE_SIMILARITY", 0.95))
+
+
+def normalize_query(q: str) -> str:
+    # "How to perform Lockout/Tagout? " and "how to perform lockout/tagout" share an entry
+    return re.sub(r"\s+", " ", q.lower()).strip().rstrip("?.! ")
+
+
+class QueryCache:
+    """
+    Two-level cache of /ask responses.
+
+    Exact: keyed by (normalized query, params), where params is everything
+    else that changes the response (k, mode, search knobs).
+    Semantic: a miss on the exact level returns the response of a cached
+    query with the same params whose embedding has cosine similarity of at
+    least `similarity` with the new one. Embeddings live in one preallocated
+    matrix, so the lookup is a single mat-vec.
+
+    Entries expire after `ttl_s` and the least recently used entry is evicted
+    once `max_size` is reached. Everything is dropped when `generation_fn`
+    (checked at most every `check_interval` seconds) reports a new index
+    generation.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl_s: float = QUERY_CACHE_TTL_S,
+                 similarity: float = QUERY_CACHE_SIMILARITY,
+                 generation_fn: Optional[Callable[[], str]] = None, check_interval: float = 1.0):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.similarity = similarity
+        self.generation_fn = generation_fn
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> [response, expires_at, slot]
+        self._generation = None
+        self._last_check = 0.0
+        # Semantic level: row `slot` of _emb belongs to _slot_key[slot]; _slot_group tags its params
+        self._emb = None
+        self._slot_key = [None] * max_size
+        self._slot_group = np.full(max_size, -1, dtype="int64")
+        self._groups: Dict[Hashable, int] = {}
+        self._free = list(range(max_size - 1, -1, -1))
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                      "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.enabled and self.similarity > 0
+
+    def get(self, query: str, params: Hashable, embedding: Optional[np.ndarray] = None,
+            count_miss: bool = True) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        (response, "exact" | "semantic") on a hit, (None, None) on a miss.
+        Pass count_miss=False for an exact-only probe that is followed by a
+        semantic lookup of the same query, so a miss is counted once.
+        """
+        if not self.enabled:
+            return None, None
+        self._check_generation()
+        key = (normalize_query(query), params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expire(key, entry, now):
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return entry[0], "exact"
+            if embedding is not None and self.semantic and self._emb is not None and params in self._groups:
+                sims = self._emb @ np.asarray(embedding, dtype="float32")
+                sims[self._slot_group != self._groups[params]] = -np.inf
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity:
+                    hit_key = self._slot_key[best]
+                    entry = self._entries[hit_key]
+                    if not self._expire(hit_key, entry, now):
+                        self._entries.move_to_end(hit_key)
+                        self.stats["semantic_hits"] += 1
+                        return entry[0], "semantic"
+            if count_miss:
+                self.stats["misses"] += 1
+            return None, None
+
+    def put(self, query: str, params: Hashable, response: Dict[str, Any],
+            embedding: Optional[np.ndarray] = None):
+        if not self.enabled:
+            return
+        key = (normalize_query(query), params)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            slot = None
+            if embedding is not None and self.semantic:
+                embedding = np.asarray(embedding, dtype="float32")
+                if self._emb is None:
+                    self._emb = np.zeros((self.max_size, embedding.shape[0]), dtype="float32")
+                slot = self._free.pop()
+                self._emb[slot] = embedding
+                self._slot_key[slot] = key
+                self._slot_group[slot] = self._groups.setdefault(params, len(self._groups))
+            self._entries[key] = [response, time.monotonic() + self.ttl_s, slot]
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._groups.clear()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats, size=len(self._entries), max_size=self.max_size,
+                         ttl_s=self.ttl_s, similarity=self.similarity, generation=self._generation)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _check_generation(self):
+        if self.generation_fn is None:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        generation = self.generation_fn()
+        if generation != self._generation:
+            if self._generation is not None:
+                self.clear()
+                self.stats["invalidations"] += 1
+            self._generation = generation
+
+    def _expire(self, key, entry, now: float) -> bool:
+        if entry[1] > now:
+            return False
+        self._remove(key)
+        self.stats["expirations"] += 1
+        return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        slot = entry[2]
+        if slot is not None:
+            self._slot_key[slot] = None
+            self._slot_group[slot] = -1
+            self._free.append(slot)
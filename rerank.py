@@ -1,93 +1,247 @@
 # rerank.py
 import os
-import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer, CrossEncoder
-import joblib
 
-# Paths
-INDEX_PATH = "data/faiss_index.bin"
-MAPPING_PATH = "data/id_mapping.npy"
-DB_PATH = "data/chunks.db"
+import chunk_store
+import metrics
+from engine import RetrievalEngine
+from inference import LazyModel, load_bi_encoder, load_cross_encoder
+from linear_scorer import COEF_PATH, LogisticScorer
 
-# Load learned reranker if exists, else fall back to cross-encoder
+# Cross-encoder cascade: a cheap vector + BM25 blend keeps the top RERANK_DEPTH candidates,
+# and only those are scored by the cross-encoder (inputs capped at RERANK_MAX_LENGTH tokens).
+# Unset means no pruning: every candidate is cross-encoded, as before the cascade.
+RERANK_DEPTH = int(os.environ["RERANK_DEPTH"]) if os.environ.get("RERANK_DEPTH") else None
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", 384))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 32))
+
+# Hybrid retrieval: fuse FAISS and full-index FTS5 BM25 results, "rrf" or "weighted"
+FUSIONS = ("rrf", "weighted")
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "rrf")
+RRF_K = 60
+HYBRID_DENSE_WEIGHT = float(os.environ.get("HYBRID_DENSE_WEIGHT", 0.7))  # "weighted" fusion only
+
+# Learned reranker if exported, else the cross-encoder. Every model loads on first use
+# (or from load_models()), so importing this module stays cheap.
+# Prefer the plain coefficient export so serving never imports sklearn/joblib.
 LEARNED_PATH = "data/reranker_lr.joblib"
-lr_model = None
-if os.path.exists(LEARNED_PATH):
-    lr_model = joblib.load(LEARNED_PATH)
-else:
-    reranker = CrossEncoder("cross-encoder/ms-marco-electra-base")
 
-# Load retriever (same model used for FAISS index build!)
-retriever = SentenceTransformer("all-mpnet-base-v2")
+def _load_lr_model():
+    if os.path.exists(COEF_PATH):
+        return LogisticScorer.load(COEF_PATH)
+    if os.path.exists(LEARNED_PATH):
+        import joblib
+        return LogisticScorer.from_sklearn(joblib.load(LEARNED_PATH))
+    return None
+
+lr_model = LazyModel(_load_lr_model)
+reranker = LazyModel(lambda: load_cross_encoder(max_length=RERANK_MAX_LENGTH))
+
+# Retriever (same model used for FAISS index build!)
+retriever = LazyModel(load_bi_encoder)
+
+# Index + ID mapping stay resident; reloaded only when build_index.py publishes a new generation
+engine = RetrievalEngine(encoder=retriever)
+
+def load_models(modes=("baseline", "rerank")):
+    """Load what `modes` need now instead of on the first request."""
+    retriever.get()
+    if "rerank" in modes and lr_model.get() is None:
+        reranker.get()
+
+def models_loaded():
+    return {
+        "bi_encoder": retriever.loaded,
+        "learned_reranker": lr_model.loaded and lr_model.get() is not None,
+        "cross_encoder": reranker.loaded,
+    }
 
 # Fetch top-K candidates from FAISS
-def fetch_candidates_faiss(query, top_k=20):
-    # Load FAISS index + ID mapping
-    index = faiss.read_index(INDEX_PATH)
-    id_mapping = np.load(MAPPING_PATH)
-
-    # Encode query with retriever
-    q_emb = retriever.encode([query], normalize_embeddings=True)
-    q_emb = np.array(q_emb).astype("float32")
-
-    # Search FAISS
-    D, I = index.search(q_emb, top_k)
-    ids = id_mapping[I[0]]
-
-    # Fetch chunk text from SQLite
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    results = []
-    for score, idx in zip(D[0], ids):
-        cur.execute("SELECT chunk_text FROM chunks WHERE chunk_id=?", (int(idx),))
-        row = cur.fetchone()
-        if row:
-            results.append((idx, score, row[0]))
-    conn.close()
-    return results
+# nprobe / ef_search override the defaults in data/index_spec.json for IVF / HNSW indexes
+def fetch_candidates_faiss(query, top_k=20, nprobe=None, ef_search=None):
+    return fetch_candidates_faiss_batch([query], top_k=top_k, nprobe=nprobe, ef_search=ef_search)[0]
 
-# Rerank with cross-encoder
-def rerank(query, candidates):
-    # candidates: list of (chunk_id, base_score, text)
-    if lr_model is not None:
-        # Use learned logistic regression with features: [vector_score, bm25_score]
-        # Compute BM25 via FTS table for given candidate chunk_ids
-        from features import bm25_scores  # lazy import
-        chunk_ids = [int(cid) for cid, _, _ in candidates]
-        id_to_bm25 = bm25_scores(query, chunk_ids)
+# Batched variant: one encode call and one multi-row FAISS search for all queries
+def fetch_candidates_faiss_batch(queries, top_k=20, nprobe=None, ef_search=None):
+    hits_per_query = engine.search_batch(queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
 
-        reranked = []
-        for chunk_id, base_score, text in candidates:
-            bm25 = id_to_bm25.get(int(chunk_id), 0.0)
-            X = np.array([[float(base_score), float(bm25)]], dtype=np.float32)
-            prob = float(lr_model.predict_proba(X)[0, 1])
-            reranked.append({
-                "chunk_id": int(chunk_id),
-                "base_score": float(base_score),
-                "bm25_score": float(bm25),
-                "rerank_score": prob,
-                "text": text[:300] + ("..." if len(text) > 300 else ""),
-            })
-        reranked.sort(key=lambda x: x["rerank_score"], reverse=True)
-        return reranked
+    # Fetch chunk text for every query's hits in one batched lookup
+    with metrics.span("hydrate"):
+        rows = chunk_store.fetch_chunks([cid for hits in hits_per_query for cid, _ in hits])
+    return [
+        [(idx, score, rows[idx]["text"]) for idx, score in hits if idx in rows]
+        for hits in hits_per_query
+    ]
+
+# Dense and lexical legs of hybrid retrieval run concurrently (FAISS, torch and sqlite release the GIL)
+_hybrid_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+def fetch_candidates_hybrid_batch(queries, top_k=50, nprobe=None, ef_search=None, fusion=None):
+    """
+    Top-k candidates per query from FAISS and from BM25 over the whole FTS5
+    index, merged by reciprocal-rank fusion or a weighted blend of min-max
+    normalized scores. Returns (candidates_list, timings_ms), where each
+    candidate is a dict with chunk_id, hybrid_score, vector_score and
+    bm25_score (None when that leg missed it), and text.
+    """
+    fusion = fusion or HYBRID_FUSION
+
+    # Each leg collects its own spans (collect() is per thread); they are merged into the caller's below
+    def dense():
+        t0 = time.perf_counter()
+        with metrics.collect() as spans:
+            hits = engine.search_batch(queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
+        return hits, (time.perf_counter() - t0) * 1000, spans
+
+    def lexical():
+        t0 = time.perf_counter()
+        with metrics.collect() as spans:
+            with metrics.span("fts_search"):
+                hits = [chunk_store.fts_search(q, top_k=top_k) for q in queries]
+        return hits, (time.perf_counter() - t0) * 1000, spans
+
+    dense_future, lexical_future = _hybrid_pool.submit(dense), _hybrid_pool.submit(lexical)
+    dense_hits, dense_ms, dense_spans = dense_future.result()
+    lexical_hits, lexical_ms, lexical_spans = lexical_future.result()
+    metrics.add_timings(dense_spans)
+    metrics.add_timings(lexical_spans)
+
+    t0 = time.perf_counter()
+    fused = [_fuse(d, l, fusion)[:top_k] for d, l in zip(dense_hits, lexical_hits)]
+    with metrics.span("hydrate"):
+        rows = chunk_store.fetch_chunks([r["chunk_id"] for cands in fused for r in cands])
+    candidates_list = [
+        [dict(r, text=rows[r["chunk_id"]]["text"]) for r in cands if r["chunk_id"] in rows]
+        for cands in fused
+    ]
+    timings = {
+        "dense_ms": round(dense_ms, 3),
+        "lexical_ms": round(lexical_ms, 3),
+        "fusion_ms": round((time.perf_counter() - t0) * 1000, 3),
+    }
+    return candidates_list, timings
+
+def _fuse(dense_hits, lexical_hits, fusion):
+    merged = {}
+    for cid, score in dense_hits:
+        merged.setdefault(cid, {"chunk_id": cid, "vector_score": None, "bm25_score": None})["vector_score"] = score
+    for cid, score in lexical_hits:
+        merged.setdefault(cid, {"chunk_id": cid, "vector_score": None, "bm25_score": None})["bm25_score"] = score
+
+    if fusion == "weighted":
+        dense_norm, lexical_norm = _min_max(dense_hits), _min_max(lexical_hits)
+        for cid, r in merged.items():
+            r["hybrid_score"] = (HYBRID_DENSE_WEIGHT * dense_norm.get(cid, 0.0)
+                                 + (1.0 - HYBRID_DENSE_WEIGHT) * lexical_norm.get(cid, 0.0))
     else:
-        # Cross-encoder fallback
-        pairs = [(query, text) for (_, _, text) in candidates]
-        scores = reranker.predict(pairs)
+        for r in merged.values():
+            r["hybrid_score"] = 0.0
+        for hits in (dense_hits, lexical_hits):
+            for rank, (cid, _) in enumerate(hits, start=1):
+                merged[cid]["hybrid_score"] += 1.0 / (RRF_K + rank)
+
+    return sorted(merged.values(), key=lambda r: r["hybrid_score"], reverse=True)
+
+def _min_max(hits):
+    if not hits:
+        return {}
+    scores = [score for _, score in hits]
+    lo, hi = min(scores), max(scores)
+    span = (hi - lo) or 1.0
+    return {cid: (score - lo) / span for cid, score in hits}
+
+# Rerank with cross-encoder
+def rerank(query, candidates, depth=None):
+    return rerank_batch([query], [candidates], depths=[depth])[0]
+
+# Rerank several queries at once; the cross-encoder sees all pairs in a single predict call.
+# depths[i] (default RERANK_DEPTH, None for all) is how many candidates of query i survive to the cross-encoder;
+# the learned reranker is cheap enough to score every candidate and ignores it.
+def rerank_batch(queries, candidates_list, depths=None):
+    # candidates_list[i]: list of (chunk_id, base_score, text) for queries[i]
+    if lr_model.get() is not None:
+        return [_rerank_learned(q, cands) for q, cands in zip(queries, candidates_list)]
+
+    # Cross-encoder fallback, stage 1: prune each query's candidates with the cheap blend
+    depths = depths or [None] * len(queries)
+    survivors = [
+        prune_candidates(q, cands, depth or RERANK_DEPTH)
+        for q, cands, depth in zip(queries, candidates_list, depths)
+    ]
+
+    # Stage 2: cross-encode the survivors of all queries, shortest texts first so
+    # each batch pads to a similar length
+    pairs = [(q, text) for q, cands in zip(queries, survivors) for (_, _, text, _) in cands]
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
+    scores = [0.0] * len(pairs)
+    if pairs:
+        with metrics.span("cross_encode"):
+            sorted_scores = reranker.get().predict([pairs[i] for i in order], batch_size=RERANK_BATCH_SIZE)
+        for i, score in zip(order, sorted_scores):
+            scores[i] = score
+
+    out, offset = [], 0
+    for cands in survivors:
         reranked = []
-        for (chunk_id, base_score, text), new_score in zip(candidates, scores):
+        for (chunk_id, base_score, text, bm25), new_score in zip(cands, scores[offset:offset + len(cands)]):
             reranked.append(
                 {
                     "chunk_id": int(chunk_id),
                     "base_score": float(base_score),
+                    "bm25_score": float(bm25),
                     "rerank_score": float(new_score),
                     "text": text[:300] + ("..." if len(text) > 300 else ""),
                 }
             )
+        offset += len(cands)
         reranked.sort(key=lambda x: x["rerank_score"], reverse=True)
-        return reranked
+        out.append(reranked)
+    return out
+
+def prune_candidates(query, candidates, depth):
+    """Top `depth` (None for all) candidates by 0.7 * vector + 0.3 * BM25, both min-max
+    normalized per query, as (chunk_id, base_score, text, bm25_score)."""
+    with metrics.span("bm25"):
+        id_to_bm25 = chunk_store.bm25_scores(query, [int(cid) for cid, _, _ in candidates])
+    scored = [
+        (cid, base_score, text, id_to_bm25.get(int(cid), 0.0))
+        for cid, base_score, text in candidates
+    ]
+    if depth is None or depth >= len(scored):
+        return scored
+    # Raw BM25 runs to ~25 against cosine in [-1, 1]; normalize so the weights mean what they say
+    vector_norm = _min_max([(i, float(r[1])) for i, r in enumerate(scored)])
+    bm25_norm = _min_max([(i, r[3]) for i, r in enumerate(scored)])
+    order = sorted(range(len(scored)), key=lambda i: 0.7 * vector_norm[i] + 0.3 * bm25_norm[i], reverse=True)
+    return [scored[i] for i in order[:depth]]
+
+def _rerank_learned(query, candidates):
+    # Use learned logistic regression with features: [vector_score, bm25_score]
+    # Compute BM25 via FTS table for given candidate chunk_ids
+    chunk_ids = [int(cid) for cid, _, _ in candidates]
+    with metrics.span("bm25"):
+        id_to_bm25 = chunk_store.bm25_scores(query, chunk_ids)
+
+    bm25 = [id_to_bm25.get(cid, 0.0) for cid in chunk_ids]
+    # Score all candidates at once
+    X = np.array([[float(base_score), float(b)] for (_, base_score, _), b in zip(candidates, bm25)],
+                 dtype=np.float32).reshape(-1, 2)
+    with metrics.span("lr_score"):
+        probs = lr_model.get().predict_proba(X)
+
+    reranked = []
+    for (chunk_id, base_score, text), b, prob in zip(candidates, bm25, probs):
+        reranked.append({
+            "chunk_id": int(chunk_id),
+            "base_score": float(base_score),
+            "bm25_score": float(b),
+            "rerank_score": float(prob),
+            "text": text[:300] + ("..." if len(text) > 300 else ""),
+        })
+    reranked.sort(key=lambda x: x["rerank_score"], reverse=True)
+    return reranked
 
 # Demo
 if __name__ == "__main__":
@@ -1,42 +1,24 @@
-import faiss
-import numpy as np
-import sqlite3
-from sentence_transformers import SentenceTransformer
+import chunk_store
+from engine import RetrievalEngine
 
-DB_PATH = "data/chunks.db"
-INDEX_PATH = "data/faiss_index.bin"
-ID_MAP_PATH = "data/id_mapping.npy"
+# Index and bi-encoder load on the first search
+engine = RetrievalEngine()
 
-index = faiss.read_index(INDEX_PATH)
-
-id_mapping = np.load(ID_MAP_PATH)
-
-model = SentenceTransformer("all-mpnet-base-v2")
-
-def search(query, k=5):
-    query_emb = model.encode([query], normalize_embeddings=True)
-
-    # Search in FAISS
-    scores, indices = index.search(query_emb, k)
+def search(query, k=5, nprobe=None, ef_search=None):
+    # nprobe / ef_search only matter for IVF / HNSW indexes
+    hits = engine.search(query, top_k=k, nprobe=nprobe, ef_search=ef_search)
+    rows = chunk_store.fetch_chunks([chunk_id for chunk_id, _ in hits])
 
     results = []
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    for score, idx in zip(scores[0], indices[0]):
-        chunk_id = int(id_mapping[idx])  # map FAISS idx → chunk_id
-        cur.execute("SELECT chunk_text, doc_id FROM chunks WHERE chunk_id = ?", (chunk_id,))
-        row = cur.fetchone()
+    for chunk_id, score in hits:
+        row = rows.get(chunk_id)
         if row:
-            chunk_text, doc_id = row
-            cur.execute("SELECT title FROM docs WHERE doc_id = ?", (doc_id,))
-            doc_title = cur.fetchone()[0]
+            chunk_text = row["text"]
             results.append({
                 "score": float(score),
                 "chunk": chunk_text[:300] + "..." if len(chunk_text) > 300 else chunk_text,
-                "doc_title": doc_title
+                "doc_title": row["title"]
             })
-    conn.close()
     return results
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+# sentences.py
+"""
+Per-chunk sentence index for extractive snippets, computed once at ingest
+and stored next to the chunk (chunks.sentence_index, and sentences.bin in the
+mmap chunk artifact):
+
+  bounds   (n, 2) character offsets of each sentence in the chunk text
+  counts   (n,)   number of distinct tokens in each sentence
+  tokens   (sum(counts),) token ids (crc32 of the lowercased [a-z0-9]+ token)
+
+Packed as one little-endian uint32 array: [n, bounds..., counts..., tokens...].
+Snippet selection is then a vectorized overlap count over every sentence of
+the full chunk instead of a regex split and set intersection per request.
+
+With SNIPPET_MODE=embedding, sentences are ranked by cosine similarity to the
+query using sentence vectors written by `build_index.py --sentence-embeddings`
+(data/sentence_embeddings); chunks without vectors fall back to overlap.
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+SNIPPET_MODE = os.environ.get("SNIPPET_MODE", "overlap")  # "overlap" | "embedding"
+SNIPPET_MAX_SENTS = 2
+SNIPPET_MAX_CHARS = 500
+SENTENCE_EMB_DIR = "data/sentence_embeddings"
+
+_SENT_BREAK = re.compile(r"(?<=[.!?])\s+")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class SentenceIndex(NamedTuple):
+    bounds: np.ndarray  # uint32 (n, 2)
+    counts: np.ndarray  # uint32 (n,)
+    tokens: np.ndarray  # uint32 (sum(counts),)
+
+
+def split_spans(text: str) -> List[Tuple[int, int]]:
+    """(start, end) of each non-empty sentence, whitespace excluded."""
+    spans = []
+    start = 0
+    for m in list(_SENT_BREAK.finditer(text)) + [None]:
+        end = m.start() if m is not None else len(text)
+        segment = text[start:end]
+        stripped = segment.strip()
+        if stripped:
+            lead = len(segment) - len(segment.lstrip())
+            spans.append((start + lead, start + lead + len(stripped)))
+        if m is not None:
+            start = m.end()
+    return spans
+
+
+def token_ids(text: str) -> np.ndarray:
+    # crc32 is stable across processes, unlike hash()
+    return np.unique(np.array([zlib.crc32(t.encode("utf-8")) for t in _TOKEN.findall(text.lower())],
+                              dtype="uint32"))
+
+
+def build(text: str) -> SentenceIndex:
+    spans = split_spans(text)
+    per_sentence = [token_ids(text[s:e]) for s, e in spans]
+    return SentenceIndex(
+        bounds=np.array(spans, dtype="uint32").reshape(-1, 2),
+        counts=np.array([len(t) for t in per_sentence], dtype="uint32"),
+        tokens=np.concatenate(per_sentence) if per_sentence else np.zeros(0, dtype="uint32"),
+    )
+
+
+def pack(index: SentenceIndex) -> bytes:
+    n = np.array([len(index.counts)], dtype="uint32")
+    return np.concatenate([n, index.bounds.ravel(), index.counts, index.tokens]).astype("<u4").tobytes()
+
+
+def unpack(blob: bytes) -> SentenceIndex:
+    arr = np.frombuffer(blob, dtype="<u4")
+    n = int(arr[0])
+    return SentenceIndex(bounds=arr[1:1 + 2 * n].reshape(n, 2), counts=arr[1 + 2 * n:1 + 3 * n],
+                         tokens=arr[1 + 3 * n:])
+
+
+def overlap_scores(query: str, index: SentenceIndex) -> np.ndarray:
+    """Distinct query tokens found in each sentence."""
+    n = len(index.counts)
+    hits = np.isin(index.tokens, token_ids(query))
+    return np.bincount(np.repeat(np.arange(n), index.counts), weights=hits, minlength=n)
+
+
+def select(text: str, index: SentenceIndex, scores: np.ndarray, max_sents: int = SNIPPET_MAX_SENTS) -> str:
+    # Highest score first, then the longer sentence, then the earlier one
+    lengths = index.bounds[:, 1].astype("int64") - index.bounds[:, 0]
+    order = np.lexsort((np.arange(len(scores)), -lengths, -scores))[:max_sents]
+    return " ".join(text[index.bounds[i, 0]:index.bounds[i, 1]] for i in order)[:SNIPPET_MAX_CHARS]
+
+
+class SentenceEmbeddings:
+    """
+    Read-only sentence vectors over the artifact written by
+    build_index.write_sentence_embeddings():
+
+      chunk_ids.npy  int64[n], sorted
+      offsets.npy    int64[n + 1], rows of chunk i are offsets[i]:offsets[i + 1]
+      vectors.f16    float16[m, dim] raw, L2-normalized, in sentence order
+      manifest.json  {"generation", "embedding_key", "dim", "n_sentences"}, written last
+    """
+
+    def __init__(self, path: str = SENTENCE_EMB_DIR):
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.generation = self.manifest["generation"]
+        self.embedding_key = self.manifest["embedding_key"]
+        self.chunk_ids = np.load(os.path.join(path, "chunk_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        n, dim = self.manifest["n_sentences"], self.manifest["dim"]
+        self.vectors = (np.memmap(os.path.join(path, "vectors.f16"), dtype="float16", mode="r", shape=(n, dim))
+                        if n else np.zeros((0, dim), dtype="float16"))
+
+    def get(self, chunk_id: int) -> Optional[np.ndarray]:
+        if not len(self.chunk_ids):
+            return None
+        i = int(np.searchsorted(self.chunk_ids, chunk_id))
+        if i >= len(self.chunk_ids) or self.chunk_ids[i] != chunk_id:
+            return None
+        return np.asarray(self.vectors[int(self.offsets[i]):int(self.offsets[i + 1])], dtype="float32")
+
+
+_emb_store = None
+_emb_checked = 0.0
+_emb_lock = threading.Lock()
+
+
+def get_sentence_embeddings(check_interval: float = 1.0) -> Optional[SentenceEmbeddings]:
+    """The current sentence vectors, reopened when a new generation is written; None if never built."""
+    global _emb_store, _emb_checked
+    now = time.monotonic()
+    if _emb_store is not None and now - _emb_checked < check_interval:
+        return _emb_store
+    with _emb_lock:
+        _emb_checked = now
+        try:
+            with open(os.path.join(SENTENCE_EMB_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+                generation = json.load(f)["generation"]
+            if _emb_store is None or _emb_store.generation != generation:
+                _emb_store = SentenceEmbeddings(SENTENCE_EMB_DIR)
+        except (OSError, ValueError, KeyError):
+            pass
+        return _emb_store
+
+
+def embedding_scores(query_vec: np.ndarray, chunk_id: int, index: SentenceIndex,
+                     embedding_key: str) -> Optional[np.ndarray]:
+    """Cosine similarity of each sentence to the query, or None if this chunk has no usable vectors."""
+    store = get_sentence_embeddings()
+    if store is None or store.embedding_key != embedding_key:
+        return None
+    vectors = store.get(int(chunk_id))
+    if vectors is None or len(vectors) != len(index.counts):
+        return None
+    return vectors @ query_vec
+
@@ -8,6 +8,8 @@ from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split
 import joblib
 
+from linear_scorer import COEF_PATH, LogisticScorer
+
 
 def load_training_pairs(features_jsonl: str):
     X, y = [], []
@@ -28,6 +30,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("features_jsonl", help="Path to training features jsonl (from features.save_features_for_questions)")
     parser.add_argument("--out", default="data/reranker_lr.joblib", help="Where to save the trained model")
+    parser.add_argument("--coef-out", default=COEF_PATH, help="Where to export plain coefficients for serving")
     parser.add_argument("--seed", type=int, default=42)
     args = parser.parse_args()
 
@@ -50,6 +53,15 @@ def main():
     joblib.dump(clf, args.out)
     print(f"Saved model to {args.out}")
 
+    scorer = LogisticScorer.from_sklearn(clf)
+    # The API scores with these coefficients; make sure they reproduce sklearn exactly
+    if not np.array_equal(scorer.predict_proba(X), clf.predict_proba(X)[:, 1]):
+        max_diff = np.abs(scorer.predict_proba(X) - clf.predict_proba(X)[:, 1]).max()
+        print(f"Warning: exported coefficients differ from sklearn by up to {max_diff:.3g}")
+    os.makedirs(os.path.dirname(args.coef_out), exist_ok=True)
+    scorer.save(args.coef_out)
+    print(f"Exported coefficients to {args.coef_out}")
+
 
 if __name__ == "__main__":
     main()
@@ -1,25 +1,119 @@
 import re
 import hashlib
+from bisect import bisect_right
+from typing import Iterable, Iterator, NamedTuple, Optional
 
-def chunk_text(text, max_chars=1200, overlap=200):
-    """Split text into overlapping chunks at sentence boundaries."""
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    chunks, current = [], []
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
 
-    for sent in sentences:
-        if sum(len(s) for s in current) + len(sent) < max_chars:
-            current.append(sent)
-        else:
-            chunk = " ".join(current).strip()
-            if chunk:
-                chunks.append(chunk)
-            # Start new chunk with overlap
-            current = current[-overlap:] if overlap and current else []
+
+class Chunk(NamedTuple):
+    text: str
+    page_start: int  # 1-based page of the first sentence
+    page_end: int  # 1-based page where the last sentence ends
+    char_start: int  # offsets into "\n".join(pages)
+    char_end: int
+
+
+def iter_sentences(pages: Iterable[str], max_len: Optional[int] = None) -> Iterator[tuple]:
+    """
+    Yield (sentence, char_start, char_end, page_start, page_end) over a stream
+    of page texts. Only the unfinished sentence at the end of a page is carried
+    over and each character is scanned for breaks once. With `max_len`, a
+    carried sentence longer than that is cut at its last space (or hard at
+    `max_len`) so the buffer stays bounded on text without sentence breaks.
+    """
+    buf, buf_start = "", 0
+    page_starts = []
+
+    def emit(piece, start):
+        stripped = piece.strip()
+        if stripped:
+            start += len(piece) - len(piece.lstrip())
+            end = start + len(stripped)
+            yield (stripped, start, end, bisect_right(page_starts, start) or 1,
+                   bisect_right(page_starts, end - 1) or 1)
+
+    def split_long():
+        nonlocal buf, buf_start
+        while max_len and len(buf) > max_len:
+            cut = buf.rfind(" ", 1, max_len + 1)
+            cut = cut if cut > 0 else max_len
+            yield from emit(buf[:cut], buf_start)
+            buf_start += cut
+            buf = buf[cut:]
+
+    for page_no, page in enumerate(pages, start=1):
+        # Breaks wholly inside the carried text were consumed on the previous
+        # page, and a break must start right after [.!?], so a new one can
+        # begin no earlier than one character before the old end.
+        scan_from = max(len(buf) - 1, 0)
+        if page_no > 1:
+            buf += "\n"
+        page_starts.append(buf_start + len(buf))
+        buf += page or ""
+        pos = 0
+        for m in SENTENCE_BREAK.finditer(buf, scan_from):
+            yield from emit(buf[pos:m.start()], buf_start + pos)
+            pos = m.end()
+        buf_start += pos
+        buf = buf[pos:]
+        yield from split_long()
+    yield from emit(buf, buf_start)
+
+
+def iter_chunks(pages: Iterable[str], max_chars: int = 1200, overlap: int = 200) -> Iterator[Chunk]:
+    """
+    Split a stream of page texts into chunks at sentence boundaries in time
+    linear in the text; a sentence longer than `max_chars` is split at spaces.
+    Each new chunk starts with the trailing sentences of the previous one
+    totalling at most `overlap` characters.
+    """
+    current = []  # (sentence, char_start, char_end, page_start, page_end)
+    current_len = 0
+
+    for sent in iter_sentences(pages, max_len=max_chars):
+        if current_len + len(sent[0]) < max_chars:
             current.append(sent)
+            current_len += len(sent[0])
+            continue
+
+        chunk = _make_chunk(current)
+        if chunk is not None:
+            yield chunk
+        # Start new chunk with up to `overlap` characters of trailing sentences
+        kept, kept_len = [], 0
+        for prev in reversed(current):
+            if kept_len + len(prev[0]) > overlap:
+                break
+            kept.append(prev)
+            kept_len += len(prev[0])
+        current = kept[::-1]
+        current.append(sent)
+        current_len = kept_len + len(sent[0])
+
+    chunk = _make_chunk(current)
+    if chunk is not None:
+        yield chunk
+
 
-    if current:
-        chunks.append(" ".join(current).strip())
-    return chunks
+def _make_chunk(sentences) -> Optional[Chunk]:
+    text = " ".join(s[0] for s in sentences).strip()
+    if not text:
+        return None
+    first, last = sentences[0], sentences[-1]
+    return Chunk(text, first[3], last[4], first[1], last[2])
+
+
+def chunk_text(text, max_chars=1200, overlap=200):
+    """Split text into overlapping chunks at sentence boundaries."""
+    return [c.text for c in iter_chunks([text], max_chars=max_chars, overlap=overlap)]
 
 def sha1_hash(text):
     return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def file_sha1(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()